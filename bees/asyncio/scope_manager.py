@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from contextvars import ContextVar
+
+from opentracing import Scope, ScopeManager
+
+_ACTIVE_SCOPE = ContextVar('bees_active_scope', default=None)
+
+
+class ContextVarsScopeManager(ScopeManager):
+    """Store the active scope in a ContextVar.
+
+    asyncio copies the current context into every task it creates, so the
+    active span follows ``await`` and ``create_task`` boundaries without
+    relying on thread-locals or greenthread attributes.
+    """
+
+    def activate(self, span, finish_on_close):
+        scope = _ContextVarsScope(self, span, finish_on_close)
+        self._set_scope(scope)
+        return scope
+
+    @property
+    def active(self):
+        return self._get_scope()
+
+    def _get_scope(self):
+        return _ACTIVE_SCOPE.get()
+
+    def _set_scope(self, scope):
+        _ACTIVE_SCOPE.set(scope)
+
+
+class _ContextVarsScope(Scope):
+    def __init__(self, manager, span, finish_on_close):
+        super(_ContextVarsScope, self).__init__(manager, span)
+        self._finish_on_close = finish_on_close
+        self._to_restore = manager.active
+
+    def close(self):
+        if self.manager.active is not self:
+            return
+
+        self.manager._set_scope(self._to_restore)
+
+        if self._finish_on_close:
+            self.span.finish()
@@ -4,7 +4,28 @@ import inspect
 import six
 from opentracing import global_tracer
 
-from .utils import get_callable_name, get_own_members
+from . import switches
+from .utils import LazyTraced, get_callable_name, get_class_functions
+
+
+_DISABLED = False
+
+
+def disable():
+    """Call traced functions without tracing them."""
+
+    global _DISABLED
+    _DISABLED = True
+
+
+def enable():
+    """Trace calls of traced functions again."""
+
+    global _DISABLED
+    _DISABLED = False
+
+
+switches.register('function', enable, disable)
 
 
 def _ensure_no_multiple_traced(traceable_attrs):
@@ -54,6 +75,8 @@ def trace(name, info=None, hide_args=False, hide_result=False,
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            if _DISABLED:
+                return func(*args, **kwargs)
 
             # get the function name and args kwargs for the function
             info_ = info
@@ -95,7 +118,8 @@ def trace(name, info=None, hide_args=False, hide_result=False,
 
 def trace_cls(name, info=None, hide_args=False, hide_result=False,
               trace_private=False, allow_multiple_trace=True,
-              trace_class_methods=False, trace_static_methods=False):
+              trace_class_methods=False, trace_static_methods=False,
+              lazy=False):
     """
     Trace decorator for instances of class.
 
@@ -118,42 +142,38 @@ def trace_cls(name, info=None, hide_args=False, hide_result=False,
     :param trace_static_methods: Trace staticmethod. This may be prone to
                                   issues so careful usage is recommended(this
                                   is also why this defaults to false)
+    :param lazy: Trace the methods of a class on first access instead of
+                 now, so methods that are never used are never wrapped
+                 (see LazyTraced)
     :return:
     """
 
-    def trace_checker(attr_name, to_be_wrapped):
+    def trace_checker(attr_name, wrapper):
         if (attr_name.startswith("__")):
             # Never trace really private methods.
-            return (False, None)
+            return False
         if not trace_private and attr_name.startswith("_"):
-            return (False, None)
-        if isinstance(to_be_wrapped, staticmethod):
-            if not trace_static_methods:
-                return (False, None)
-            return (True, staticmethod)
-        if isinstance(to_be_wrapped, classmethod):
-            if not trace_class_methods:
-                return (False, None)
-            return (True, classmethod)
-        return (True, None)
+            return False
+        if wrapper is staticmethod:
+            return trace_static_methods
+        if wrapper is classmethod:
+            return trace_class_methods
+        return True
+
+    def traced(attr):
+        return trace(name, info=info, hide_args=hide_args,
+                     hide_result=hide_result)(attr)
 
     def decorator(cls):
-        # get the classs name for the cls
-        clss = cls if inspect.isclass(cls) else cls.__class__
-        mro_dicts = [c.__dict__ for c in inspect.getmro(clss)]
+        is_class = inspect.isclass(cls)
         traceable_attrs = []
         traceable_wrappers = []
-        for attr_name, attr in get_own_members(cls):
-            if not (inspect.ismethod(attr) or inspect.isfunction(attr)):
-                continue
-            wrapped_obj = None
-            for cls_dict in mro_dicts:
-                if attr_name in cls_dict:
-                    wrapped_obj = cls_dict[attr_name]
-                    break
-            should_wrap, wrapper = trace_checker(attr_name, wrapped_obj)
-            if not should_wrap:
+        for attr_name, attr, wrapper in get_class_functions(cls):
+            if not trace_checker(attr_name, wrapper):
                 continue
+            if not is_class:
+                # traced on the instance, so trace the bound method
+                attr, wrapper = getattr(cls, attr_name), None
             traceable_attrs.append((attr_name, attr))
             traceable_wrappers.append(wrapper)
         if not allow_multiple_trace:
@@ -161,9 +181,12 @@ def trace_cls(name, info=None, hide_args=False, hide_result=False,
             # halfway trace this class).
             _ensure_no_multiple_traced(traceable_attrs)
         for i, (attr_name, attr) in enumerate(traceable_attrs):
-            wrapped_method = trace(name, info=info, hide_args=hide_args,
-                                   hide_result=hide_result)(attr)
             wrapper = traceable_wrappers[i]
+            if lazy and is_class:
+                setattr(cls, attr_name,
+                        LazyTraced(cls, attr_name, attr, wrapper, traced))
+                continue
+            wrapped_method = traced(attr)
             if wrapper is not None:
                 wrapped_method = wrapper(wrapped_method)
             setattr(cls, attr_name, wrapped_method)
@@ -182,7 +205,8 @@ class TraceMeta(type):
     >>>                        'info': None,
     >>>                        'hide_args': False,
     >>>                        'hide_result': True,
-    >>>                        'trace_private': False}
+    >>>                        'trace_private': False,
+    >>>                        'lazy': False}
     >>>
     >>>      def my_method(self, some_args):
     >>>          pass
@@ -193,7 +217,8 @@ class TraceMeta(type):
     Adding of this metaclass requires to set __trace_args__ attribute to the
     class we want to modify. __trace_args__ is the dictionary with one
     mandatory key included - "name", that will define name of action to be
-    traced -E.g wsgi, rpc
+    traced -E.g wsgi, rpc. With 'lazy', methods are traced on first access
+    (see LazyTraced)
     """
 
     def __init__(cls, cls_name, bases, attrs):
@@ -202,6 +227,7 @@ class TraceMeta(type):
         trace_args = dict(getattr(cls, "__trace_args__", {}))
         trace_private = trace_args.pop("trace_private", False)
         allow_multiple_trace = trace_args.pop("allow_multiple_trace", True)
+        lazy = trace_args.pop("lazy", False)
         if "name" not in trace_args:
             raise TypeError("Please specify __trace_args__ class level "
                             "dictionary attribute with mandaotory 'name' key - "
@@ -220,5 +246,10 @@ class TraceMeta(type):
         if not allow_multiple_trace:
             _ensure_no_multiple_traced(traceable_attrs)
         for attr_name, attr_value in traceable_attrs:
+            if lazy:
+                setattr(cls, attr_name, LazyTraced(
+                    cls, attr_name, attr_value, None,
+                    lambda attr: trace(**trace_args)(attr)))
+                continue
             setattr(cls, attr_name, trace(**trace_args)(getattr(cls,
                                                                 attr_name)))
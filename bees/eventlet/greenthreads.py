@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Carry the active span into greenthreads spawned by eventlet.
+
+The scope managers keep the active scope per greenthread, so work handed
+to ``eventlet.spawn``, ``spawn_n``, ``spawn_after`` or a ``GreenPool``
+(which calls ``eventlet.spawn``/``spawn_n``) starts with no active span.
+:func:`patch_spawn` makes those functions capture the active span and
+activate it in the child, without finishing it there. Nothing is
+allocated when no span is active, and no span is ever created.
+
+Code that imported ``spawn`` by name before :func:`patch_spawn` ran keeps
+the unpatched function.
+"""
+
+import eventlet
+from eventlet import greenthread
+from opentracing import global_tracer
+
+from ..patch import wrapping
+
+_spawn = greenthread.spawn
+_spawn_n = greenthread.spawn_n
+_spawn_after = greenthread.spawn_after
+
+
+def _bind(func):
+    """Return ``func`` bound to the active span, or ``func`` if there is none."""
+
+    scope_manager = global_tracer().scope_manager
+    scope = scope_manager.active
+    if scope is None:
+        return func
+    span = scope.span
+    inherit = getattr(scope_manager, 'inherit', None)
+
+    def run_in_parent_span(*args, **kwargs):
+        if inherit is not None:
+            child_scope = inherit(span)
+        else:
+            child_scope = scope_manager.activate(span, finish_on_close=False)
+        with child_scope:
+            return func(*args, **kwargs)
+
+    return run_in_parent_span
+
+
+def spawn_wrapper(func, *args, **kwargs):
+    """Wraps eventlet.greenthread.spawn"""
+
+    return _spawn(_bind(func), *args, **kwargs)
+
+
+def spawn_n_wrapper(func, *args, **kwargs):
+    """Wraps eventlet.greenthread.spawn_n"""
+
+    return _spawn_n(_bind(func), *args, **kwargs)
+
+
+def spawn_after_wrapper(seconds, func, *args, **kwargs):
+    """Wraps eventlet.greenthread.spawn_after"""
+
+    return _spawn_after(seconds, _bind(func), *args, **kwargs)
+
+
+_WRAPPERS = (
+    ('spawn', spawn_wrapper),
+    ('spawn_n', spawn_n_wrapper),
+    ('spawn_after', spawn_after_wrapper),
+)
+
+
+def patch_spawn():
+    for name, wrapper in _WRAPPERS:
+        wrapping.patch(greenthread, name, wrapper)
+        wrapping.patch(eventlet, name, wrapper)
+
+
+def unpatch_spawn():
+    for name, _ in _WRAPPERS:
+        wrapping.unpatch(greenthread, name)
+        wrapping.unpatch(eventlet, name)
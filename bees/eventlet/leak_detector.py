@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""Debug mode that finds scopes left open on greenthreads.
+
+A traced function that exits without closing its scope leaves the scope
+active on its greenthread, and every span started there afterwards is
+parented to it. :class:`LeakDetectingScopeManager` keeps track of every
+open scope, optionally samples the stack that opened it, and logs scopes
+open for longer than a threshold. With :func:`patch_pool`, scopes still
+open when a greenthread hands its slot back to a ``GreenPool`` are
+reported and the greenthread's scope state is reset.
+
+This costs a dictionary insert and delete per scope and is meant for
+debugging, not for production traffic.
+"""
+
+import logging
+import random
+import threading
+import time
+import traceback
+
+import eventlet
+from eventlet.greenpool import GreenPool
+from opentracing import global_tracer
+
+from .scope_manager import SLOT_ATTR, EventletScopeManager, _EventletScope, _slot
+from ..patch import wrapping
+
+logger = logging.getLogger(__name__)
+
+_GreenPool_spawn_done = GreenPool._spawn_done
+
+#: Frames kept per sampled stack.
+STACK_LIMIT = 16
+
+
+class _Record(object):
+    __slots__ = ('scope', 'greenthread', 'opened_at', 'stack', 'inherited', 'reported', 'closed')
+
+    def __init__(self, scope, greenthread, opened_at, stack, inherited):
+        self.scope = scope
+        self.greenthread = greenthread
+        self.opened_at = opened_at
+        self.stack = stack
+        self.inherited = inherited
+        self.reported = False
+        # close() was called while another scope was active on top of it
+        self.closed = False
+
+    def to_dict(self, now):
+        return {
+            'operation_name': getattr(self.scope.span, 'operation_name', None),
+            'greenthread': repr(self.greenthread),
+            'age': now - self.opened_at,
+            'stack': None if self.stack is None else ''.join(traceback.format_list(self.stack)),
+        }
+
+
+class _TrackedScope(_EventletScope):
+    __slots__ = ()
+
+    def close(self):
+        self._manager._closed(self, self._slot.scope is self)
+        super(_TrackedScope, self).close()
+
+
+class LeakDetectingScopeManager(EventletScopeManager):
+    """EventletScopeManager that tracks open scopes.
+
+    :param threshold: seconds after which an open scope is reported.
+    :param stack_sample_rate: fraction of scopes whose opening stack is
+        recorded.
+    :param check_interval: seconds between checks for old scopes, made
+        while activating scopes; ``None`` leaves checks to :meth:`check`.
+    """
+
+    def __init__(self, threshold=60.0, stack_sample_rate=0.01, check_interval=10.0):
+        self.threshold = threshold
+        self.stack_sample_rate = stack_sample_rate
+        self.check_interval = check_interval
+        self._open = {}
+        self._lock = threading.Lock()
+        self._next_check = time.monotonic() + (check_interval or 0)
+
+    def activate(self, span, finish_on_close):
+        return self._activate(span, finish_on_close, False)
+
+    def inherit(self, span):
+        return self._activate(span, False, True)
+
+    def _activate(self, span, finish_on_close, inherited):
+        greenthread = eventlet.getcurrent()
+        slot = _slot(greenthread)
+        scope = _TrackedScope(self, span, finish_on_close, slot)
+        slot.scope = scope
+
+        stack = None
+        if self.stack_sample_rate and random.random() < self.stack_sample_rate:
+            stack = traceback.extract_stack(limit=STACK_LIMIT)[:-2]
+        now = time.monotonic()
+        with self._lock:
+            self._open[id(scope)] = _Record(scope, greenthread, now, stack, inherited)
+        if self.check_interval is not None and now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self.check()
+        return scope
+
+    def _closed(self, scope, active):
+        with self._lock:
+            if active:
+                self._open.pop(id(scope), None)
+            else:
+                record = self._open.get(id(scope))
+                if record is not None:
+                    record.closed = True
+
+    def open_scopes(self, threshold=0.0):
+        """Return the scopes open for at least ``threshold`` seconds, oldest first."""
+
+        now = time.monotonic()
+        with self._lock:
+            records = [record for record in self._open.values() if now - record.opened_at >= threshold]
+        records.sort(key=lambda record: record.opened_at)
+        return [record.to_dict(now) for record in records]
+
+    def check(self):
+        """Log scopes open for longer than the threshold, once each.
+
+        Scopes of greenthreads that have exited are forgotten once reported.
+
+        :returns: the number of newly reported scopes.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            records = [record for record in self._open.values()
+                       if not record.reported and now - record.opened_at >= self.threshold]
+            for record in records:
+                record.reported = True
+            for key, record in list(self._open.items()):
+                if record.reported and record.greenthread.dead:
+                    del self._open[key]
+        for record in records:
+            logger.warning("Scope open for %.1fs: %s", now - record.opened_at, record.to_dict(now))
+        return len(records)
+
+    def reset_greenthread(self, greenthread=None):
+        """Drop the scopes left open on a greenthread, keeping inherited ones.
+
+        :returns: the number of scopes dropped.
+        """
+
+        if greenthread is None:
+            greenthread = eventlet.getcurrent()
+        slot = getattr(greenthread, SLOT_ATTR, None)
+        if slot is None:
+            return 0
+
+        now = time.monotonic()
+        leaked = []
+        scope = slot.scope
+        with self._lock:
+            while scope is not None:
+                record = self._open.get(id(scope))
+                if record is not None:
+                    if record.inherited and not record.closed:
+                        # still to be closed by the spawn wrapper
+                        break
+                    del self._open[id(scope)]
+                    if not record.inherited:
+                        leaked.append(record)
+                scope = scope._to_restore
+            slot.scope = scope
+        for record in leaked:
+            logger.warning("Scope left open by %r: %s", greenthread, record.to_dict(now))
+        return len(leaked)
+
+
+def spawn_done_wrapper(self, coro):
+    """Wraps eventlet.greenpool.GreenPool._spawn_done
+
+    Runs in the greenthread that finished its work, just before the pool
+    slot is released.
+    """
+
+    scope_manager = global_tracer().scope_manager
+    if isinstance(scope_manager, LeakDetectingScopeManager):
+        scope_manager.reset_greenthread()
+    return _GreenPool_spawn_done(self, coro)
+
+
+def patch_pool():
+    wrapping.patch(GreenPool, '_spawn_done', spawn_done_wrapper)
+
+
+def unpatch_pool():
+    wrapping.unpatch(GreenPool, '_spawn_done')
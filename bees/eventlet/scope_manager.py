@@ -1,44 +1,104 @@
 # -*- coding: utf-8 -*-
 
 import eventlet
-from opentracing import Scope, ScopeManager
-from opentracing.scope_managers.constants import ACTIVE_ATTR
+from opentracing import ScopeManager, Span
+
+#: Greenthread attribute holding its :class:`_Slot`.
+SLOT_ATTR = '_bees_scope_slot'
+
+
+class _Slot(object):
+    """Per-greenthread holder of the active scope.
+
+    Attached to a greenthread once; scopes keep a reference to the slot
+    they were activated in, so closing a scope needs neither
+    ``eventlet.getcurrent()`` nor an attribute lookup on the greenthread.
+    """
+
+    __slots__ = ('scope',)
+
+    def __init__(self):
+        self.scope = None
+
+
+def _slot(greenthread):
+    try:
+        return getattr(greenthread, SLOT_ATTR)
+    except AttributeError:
+        slot = _Slot()
+        setattr(greenthread, SLOT_ATTR, slot)
+        return slot
 
 
 class EventletScopeManager(ScopeManager):
     def activate(self, span, finish_on_close):
-        scope = _EventletScope(self, span, finish_on_close)
-        self._set_scope(scope)
+        slot = _slot(eventlet.getcurrent())
+        scope = _EventletScope(self, span, finish_on_close, slot)
+        slot.scope = scope
         return scope
 
+    def inherit(self, span):
+        """Activate a span started by another greenthread, e.g. the one
+        that spawned this one. The span is not finished on close."""
+
+        return self.activate(span, finish_on_close=False)
+
     @property
     def active(self):
-        return self._get_scope()
+        slot = getattr(eventlet.getcurrent(), SLOT_ATTR, None)
+        return None if slot is None else slot.scope
 
     def _get_scope(self, greenthread=None):
         if greenthread is None:
             greenthread = eventlet.getcurrent()
 
-        return getattr(greenthread, ACTIVE_ATTR, None)
+        slot = getattr(greenthread, SLOT_ATTR, None)
+        return None if slot is None else slot.scope
 
     def _set_scope(self, scope, greenthread=None):
         if greenthread is None:
             greenthread = eventlet.getcurrent()
 
-        setattr(greenthread, ACTIVE_ATTR, scope)
+        _slot(greenthread).scope = scope
 
 
-class _EventletScope(Scope):
-    def __init__(self, manager, span, finish_on_close):
-        super(_EventletScope, self).__init__(manager, span)
+class _EventletScope(object):
+    """Implements the :class:`opentracing.Scope` interface.
+
+    It does not subclass Scope, which has no ``__slots__`` and would give
+    every instance a ``__dict__``.
+    """
+
+    __slots__ = ('_manager', '_span', '_finish_on_close', '_slot', '_to_restore')
+
+    def __init__(self, manager, span, finish_on_close, slot):
+        self._manager = manager
+        self._span = span
         self._finish_on_close = finish_on_close
-        self._to_restore = manager.active
+        self._slot = slot
+        self._to_restore = slot.scope
+
+    @property
+    def span(self):
+        return self._span
+
+    @property
+    def manager(self):
+        return self._manager
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        Span._on_error(self._span, exc_type, exc_val, exc_tb)
+        self.close()
 
     def close(self):
-        if self.manager.active is not self:
+        slot = self._slot
+        if slot.scope is not self:
             return
 
-        self.manager._set_scope(self._to_restore)
+        slot.scope = self._to_restore
 
         if self._finish_on_close:
-            self.span.finish()
+            self._span.finish()
@@ -5,6 +5,9 @@ import os
 import yaml
 from jaeger_client import Config
 
+from . import switches
+from .asyncio.scope_manager import ContextVarsScopeManager
+from .eventlet import greenthreads, leak_detector
 from .eventlet.config import BeesConfig
 from .eventlet.scope_manager import EventletScopeManager
 
@@ -12,13 +15,25 @@ REPORTING_HOST = os.environ.get("REPORTING_HOST") or "127.0.0.1"
 REPORTING_PORT = os.environ.get("REPORTING_PORT") or "6831"
 
 
-def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=False):
+def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=False,
+                   contextvars_scope_manager=False, propagate_spawn=False, span_leak_threshold=None,
+                   switch_file=None):
     """ Initialize global tracer 
 
     :param service: trace service name
     :param conf:
     :param eventlet:
     :eventlet_scope_manager:
+    :contextvars_scope_manager: use ContextVarsScopeManager (asyncio services),
+        with or without eventlet; exclusive with eventlet_scope_manager
+    :propagate_spawn: carry the active span into greenthreads spawned by
+        eventlet.spawn/spawn_n/spawn_after and GreenPool
+    :span_leak_threshold: debug mode for the eventlet scope manager; log
+        scopes open for longer than this many seconds and reset scopes
+        left open by GreenPool greenthreads. Implies
+        eventlet_scope_manager and requires eventlet
+    :switch_file: control file turning instrumentation on and off per
+        subsystem, loaded now and reloaded on SIGUSR2 (see bees.switches)
 
     """
     # with open(conf) as f:
@@ -26,8 +41,27 @@ def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=Fa
     #
     # config = Config(config=c, service_name=service)
 
+    if span_leak_threshold is not None:
+        if not eventlet:
+            raise ValueError("span_leak_threshold requires eventlet=True")
+        eventlet_scope_manager = True
+
+    if eventlet_scope_manager and contextvars_scope_manager:
+        raise ValueError("eventlet_scope_manager and contextvars_scope_manager "
+                         "are mutually exclusive")
+
+    if switch_file is not None:
+        switches.install_signal_handler(switch_file)
+
     if eventlet:
+        if propagate_spawn:
+            greenthreads.patch_spawn()
         if eventlet_scope_manager:
+            if span_leak_threshold is not None:
+                scope_manager = leak_detector.LeakDetectingScopeManager(threshold=span_leak_threshold)
+                leak_detector.patch_pool()
+            else:
+                scope_manager = EventletScopeManager()
             config = BeesConfig(
                 config={
                     'sampler': {
@@ -42,7 +76,7 @@ def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=Fa
                     }
                 },
                 service_name=service,
-                scope_manager=EventletScopeManager(),
+                scope_manager=scope_manager,
             )
         else:
             config = BeesConfig(
@@ -59,6 +93,7 @@ def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=Fa
                     }
                 },
                 service_name=service,
+                scope_manager=ContextVarsScopeManager() if contextvars_scope_manager else None,
             )
     else:
         config = Config(
@@ -75,6 +110,7 @@ def init_from_conf(service, conf=None, eventlet=False, eventlet_scope_manager=Fa
                 }
             },
             service_name=service,
+            scope_manager=ContextVarsScopeManager() if contextvars_scope_manager else None,
         )
 
     return config.initialize_tracer()
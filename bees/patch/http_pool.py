@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent HTTP sessions for proxies that forward many small requests.
+
+One :class:`requests.Session` is kept per (scheme, host, verify, cert)
+configuration, so connections to e.g. nova-metadata are kept alive and
+reused instead of being set up (including TLS) for every request. The
+number of sessions and of connections per host are bounded; greenthreads
+wait for a free connection once a host's pool is exhausted. Sessions are
+shared by requests of every instance and tenant, so they never store
+cookies.
+"""
+
+import collections
+import http.cookiejar
+import threading
+import time
+from contextvars import ContextVar
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+#: Number of host/cert configurations that keep a session.
+MAX_SESSIONS = 16
+
+#: Open connections kept per host.
+POOL_MAXSIZE = 32
+
+# connect time of the request made by the current thread/greenthread
+_CONNECT_TIME = ContextVar('bees_http_connect_time', default=None)
+
+_SESSIONS = collections.OrderedDict()
+_SESSIONS_LOCK = threading.Lock()
+
+
+class _NoCookies(http.cookiejar.DefaultCookiePolicy):
+    """Cookie policy that neither stores nor returns any cookie."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class _PooledSession(object):
+    __slots__ = ('session', 'users', 'retired')
+
+    def __init__(self, session):
+        self.session = session
+        # requests in progress; a retired session is closed by the last one
+        self.users = 0
+        self.retired = False
+
+
+class _Timing(object):
+    __slots__ = ('connect_time',)
+
+    def __init__(self):
+        self.connect_time = None
+
+
+def _timed_connect(connect):
+    def timed(self):
+        start = time.monotonic()
+        try:
+            return connect(self)
+        finally:
+            timing = _CONNECT_TIME.get()
+            if timing is not None:
+                timing.connect_time = (timing.connect_time or 0.0) + time.monotonic() - start
+    return timed
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    connect = _timed_connect(HTTPConnection.connect)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    connect = _timed_connect(HTTPSConnection.connect)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record how long they took to connect."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_TimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+def _new_session():
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookies())
+    adapter = _TimedAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _retire(pooled):
+    """Close ``pooled`` now if idle, else when its last request ends.
+
+    Called with _SESSIONS_LOCK held; returns the session to close.
+    """
+
+    pooled.retired = True
+    return pooled.session if pooled.users == 0 else None
+
+
+def _acquire(key):
+    to_close = None
+    with _SESSIONS_LOCK:
+        pooled = _SESSIONS.get(key)
+        if pooled is not None:
+            _SESSIONS.move_to_end(key)
+        else:
+            pooled = _SESSIONS[key] = _PooledSession(_new_session())
+            if len(_SESSIONS) > MAX_SESSIONS:
+                to_close = _retire(_SESSIONS.popitem(last=False)[1])
+        pooled.users += 1
+    if to_close is not None:
+        to_close.close()
+    return pooled
+
+
+def _release(pooled):
+    with _SESSIONS_LOCK:
+        pooled.users -= 1
+        to_close = pooled.session if pooled.retired and pooled.users == 0 else None
+    if to_close is not None:
+        to_close.close()
+
+
+def session_for(scheme, netloc, verify=True, cert=None):
+    """Return the shared session for one host and TLS configuration.
+
+    The session is not marked in use; it may be closed once evicted.
+    """
+
+    pooled = _acquire((scheme, netloc, verify, cert))
+    _release(pooled)
+    return pooled.session
+
+
+def close_sessions():
+    """Close all shared sessions, each once its requests in progress end."""
+
+    with _SESSIONS_LOCK:
+        to_close = [_retire(pooled) for pooled in _SESSIONS.values()]
+        _SESSIONS.clear()
+    for session in to_close:
+        if session is not None:
+            session.close()
+
+
+def request(span, scheme, netloc, method, url, verify=True, cert=None, **kwargs):
+    """Send a request through the shared session, tagging ``span`` with
+    connection reuse, connect time and time to the response headers."""
+
+    timing = _Timing()
+    token = _CONNECT_TIME.set(timing)
+    pooled = _acquire((scheme, netloc, verify, cert))
+    try:
+        resp = pooled.session.request(method=method, url=url, verify=verify, cert=cert, **kwargs)
+    finally:
+        _release(pooled)
+        _CONNECT_TIME.reset(token)
+
+    if span is not None:
+        elapsed = resp.elapsed.total_seconds()
+        span.set_tag('http.connection_reused', timing.connect_time is None)
+        if timing.connect_time is not None:
+            span.set_tag('http.connect_time', timing.connect_time)
+        span.set_tag('http.response_time', max(elapsed - (timing.connect_time or 0.0), 0.0))
+    return resp
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""Tracing and caching of the metadata proxy's instance/tenant lookups.
+
+``MetadataProxyHandler._get_instance_and_tenant_id`` resolves the remote
+IP of a metadata request to an instance through RPCs to neutron-server.
+cloud-init fetches dozens of metadata paths while a VM boots, so the same
+(network or router, remote IP) pair is resolved over and over. Each lookup
+gets a child span and is counted as a cache ``hit``, ``miss`` or forced
+``refresh``; an optional TTL cache answers repeated lookups without RPCs.
+The cache keeps working while the ``web`` switch turns tracing off.
+"""
+
+import collections
+import threading
+import time
+
+from opentracing import global_tracer
+
+from .. import stats, web
+
+# cache time to live in seconds, None when the cache is disabled
+_TTL = None
+_MAX_ENTRIES = 4096
+
+# (network or router id, remote IP) -> (expires at, (instance id, tenant id))
+_CACHE = collections.OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+# lookup latency and count by outcome: hit, miss or refresh
+_LOOKUPS = stats.Aggregator({'latency': stats.LATENCY_BUCKETS})
+
+
+def set_cache(ttl=None, max_entries=4096):
+    """Cache resolved instances for ``ttl`` seconds; ``None`` disables the cache."""
+
+    global _TTL, _MAX_ENTRIES
+    _TTL = ttl
+    _MAX_ENTRIES = max_entries
+    clear_cache()
+
+
+def clear_cache():
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def dump_statistics():
+    """Return lookup counts and latency histograms by outcome."""
+
+    return _LOOKUPS.dump()
+
+
+def reset_statistics():
+    _LOOKUPS.reset()
+
+
+def _cache_key(req):
+    headers = req.headers
+    return (headers.get('X-Neutron-Network-ID') or headers.get('X-Neutron-Router-ID'),
+            headers.get('X-Forwarded-For'))
+
+
+def _cached(key, now):
+    with _CACHE_LOCK:
+        entry = _CACHE.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del _CACHE[key]
+            return None
+        _CACHE.move_to_end(key)
+        return entry[1]
+
+
+def _store(key, value, now):
+    with _CACHE_LOCK:
+        _CACHE[key] = (now + _TTL, value)
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > _MAX_ENTRIES:
+            _CACHE.popitem(last=False)
+
+
+def lookup(get_instance_and_tenant_id, handler, req, skip_cache=False):
+    """Resolve ``req`` to ``(instance_id, tenant_id)`` in a traced lookup.
+
+    :param get_instance_and_tenant_id: the unpatched handler method.
+    """
+
+    key = _cache_key(req)
+    start = time.monotonic()
+    if _TTL is not None and not skip_cache:
+        value = _cached(key, start)
+        if value is not None:
+            if web._DISABLED:
+                return value
+            _LOOKUPS.observe('hit', 'latency', time.monotonic() - start)
+            span = global_tracer().active_span
+            if span is not None:
+                span.set_tag('metadata.lookup', 'hit')
+            return value
+    elif skip_cache:
+        with _CACHE_LOCK:
+            _CACHE.pop(key, None)
+
+    if web._DISABLED:
+        value = get_instance_and_tenant_id(handler, req, skip_cache=skip_cache)
+    else:
+        value = _traced_lookup(get_instance_and_tenant_id, handler, req, key, skip_cache, start)
+    if _TTL is not None and value[0]:
+        _store(key, value, time.monotonic())
+    return value
+
+
+def _traced_lookup(get_instance_and_tenant_id, handler, req, key, skip_cache, start):
+    outcome = 'refresh' if skip_cache else 'miss'
+    with global_tracer().start_active_span('get_instance_and_tenant_id') as scope:
+        span = scope.span
+        span.set_tag('metadata.lookup', outcome)
+        span.set_tag('metadata.network_id', req.headers.get('X-Neutron-Network-ID'))
+        span.set_tag('metadata.router_id', req.headers.get('X-Neutron-Router-ID'))
+        span.set_tag('metadata.remote_address', key[1])
+        try:
+            value = get_instance_and_tenant_id(handler, req, skip_cache=skip_cache)
+        finally:
+            _LOOKUPS.observe(outcome, 'latency', time.monotonic() - start)
+        span.set_tag('metadata.instance_id', value[0])
+    return value
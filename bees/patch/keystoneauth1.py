@@ -1,45 +1,233 @@
 # -*- coding: utf-8 -*-
 
+import time
+from contextvars import ContextVar
 
 from keystoneauth1.session import Session
 from opentracing import global_tracer
+from opentracing.ext import tags
 from opentracing.propagation import Format
 
+from . import wrapping
+from .. import stats, switches
+
 _Session_request = Session.request
+_Session_send_request = Session._send_request
+_Session_get_auth_headers = Session.get_auth_headers
+_Session_invalidate = Session.invalidate
+
+# read from the *args, **kwargs of Session.request; headers go through **kwargs
+_REQUEST_ARGUMENTS = wrapping.Arguments('endpoint_filter', 'microversion_service_type', var_keyword=True)
+
+# trace requests made without an active span, e.g. token refreshes and
+# periodic tasks, as root spans
+_ROOT_SPANS = False
+
+# attempts and auth time of the request made by the current thread/greenthread
+_CURRENT_REQUEST = ContextVar('bees_keystoneauth1_request', default=None)
+
+# client latency by (service type, HTTP method)
+_ENDPOINTS = stats.Aggregator({
+    'latency': stats.LATENCY_BUCKETS,
+    'auth_time': stats.LATENCY_BUCKETS,
+    'response_bytes': stats.SIZE_BUCKETS,
+})
+
+
+_DISABLED = False
+
+
+def disable():
+    """Call keystoneauth1 sessions without tracing them."""
+
+    global _DISABLED
+    _DISABLED = True
+
+
+def enable():
+    """Trace keystoneauth1 requests again."""
+
+    global _DISABLED
+    _DISABLED = False
+
+
+switches.register('http', enable, disable)
+
+
+class _RequestStats(object):
+    __slots__ = ('attempts', 'auth_time', 'reauth')
+
+    def __init__(self):
+        self.attempts = 0
+        self.auth_time = 0.0
+        self.reauth = False
+
+
+def set_root_spans(enabled=False):
+    """Also trace requests made while no span is active, each in a new trace.
+
+    Off by default: such requests (token refreshes, periodic tasks) are
+    sent untraced and are not counted in the statistics.
+    """
+
+    global _ROOT_SPANS
+    _ROOT_SPANS = enabled
+
+
+def dump_statistics():
+    """Return latency, auth time and response size histograms and
+    request/error/retry/re-auth counters per service type and method."""
+
+    return [dict(entry, service_type=service_type, method=method)
+            for (service_type, method), entry in _ENDPOINTS.dump().items()]
+
+
+def reset_statistics():
+    """Drop all aggregated per-endpoint statistics."""
 
+    _ENDPOINTS.reset()
 
-def request_wrapper(self, url, method, json=None, original_ip=None,
-                    user_agent=None, redirect=None, authenticated=None,
-                    endpoint_filter=None, auth=None, requests_auth=None,
-                    raise_exc=True, allow_reauth=True, log=True,
-                    endpoint_override=None, connect_retries=None, logger=None,
-                    allow=None, client_name=None, client_version=None,
-                    microversion=None, microversion_service_type=None,
-                    status_code_retries=0, retriable_status_codes=None,
-                    rate_semaphore=None, global_request_id=None,
-                    connect_retry_delay=None, status_code_retry_delay=None,
-                    **kwargs):
+
+def _service_type(endpoint_filter, microversion_service_type):
+    if endpoint_filter and endpoint_filter.get('service_type'):
+        return endpoint_filter['service_type']
+    return microversion_service_type
+
+
+def _response_bytes(resp, stream):
+    length = resp.headers.get('Content-Length')
+    if length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    if not stream:
+        return len(resp.content)
+    return None
+
+
+def _tag_response(span, key, resp, request, stream):
+    span.set_tag(tags.HTTP_STATUS_CODE, resp.status_code)
+    if resp.status_code >= 400:
+        span.set_tag(tags.ERROR, True)
+    # time until the response headers were parsed, per requests
+    span.set_tag('http.elapsed', resp.elapsed.total_seconds())
+    redirects = len(resp.history)
+    if redirects:
+        span.set_tag('http.redirects', redirects)
+    retries = request.attempts - 1 - redirects - (1 if request.reauth else 0)
+    if retries > 0:
+        span.set_tag('http.retries', retries)
+        _ENDPOINTS.incr(key, 'retries', retries)
+    response_bytes = _response_bytes(resp, stream)
+    if response_bytes is not None:
+        span.set_tag('http.response_bytes', response_bytes)
+        _ENDPOINTS.observe(key, 'response_bytes', response_bytes)
+
+
+def request_wrapper(self, url, method, *args, **kwargs):
     """Wraps keystoneauth1.session.Session.request"""
 
-    headers = kwargs.setdefault('headers', dict())
-    headers = dict(headers)
+    if _DISABLED:
+        return _Session_request(self, url, method, *args, **kwargs)
 
     tracer = global_tracer()
-    span = tracer.active_span
-    if span:
-        tracer.inject(span, Format.HTTP_HEADERS, headers)
-        kwargs['headers'] = headers
-
-    resp = _Session_request(self, url, method, json, original_ip,
-                            user_agent, redirect, authenticated,
-                            endpoint_filter, auth, requests_auth,
-                            raise_exc, allow_reauth, log,
-                            endpoint_override, connect_retries, logger,
-                            allow, client_name, client_version,
-                            microversion, microversion_service_type,
-                            status_code_retries, retriable_status_codes,
-                            rate_semaphore, global_request_id,
-                            connect_retry_delay, status_code_retry_delay,
-                            **kwargs)
-
-    return resp
+    parent = tracer.active_span
+    if parent is None and not _ROOT_SPANS:
+        return _Session_request(self, url, method, *args, **kwargs)
+
+    headers = wrapping.headers(kwargs)
+
+    service_type = _service_type(_REQUEST_ARGUMENTS.get(args, kwargs, 'endpoint_filter'),
+                                 _REQUEST_ARGUMENTS.get(args, kwargs, 'microversion_service_type'))
+    key = (service_type, method)
+
+    span = tracer.start_span(operation_name='HTTP_CLIENT', child_of=parent)
+    span.set_tag(tags.SPAN_KIND, tags.SPAN_KIND_RPC_CLIENT)
+    span.set_tag(tags.HTTP_METHOD, method)
+    span.set_tag(tags.HTTP_URL, url)
+    if service_type:
+        span.set_tag('http.service_type', service_type)
+    # a fresh span per request, so there is no carrier worth memoizing
+    tracer.inject(span.context, Format.HTTP_HEADERS, headers)
+
+    request = _RequestStats()
+    token = _CURRENT_REQUEST.set(request)
+    _ENDPOINTS.incr(key, 'requests')
+    start = time.monotonic()
+    try:
+        with tracer.scope_manager.activate(span, finish_on_close=True):
+            try:
+                resp = _Session_request(self, url, method, *args, **kwargs)
+            except Exception as e:
+                response = getattr(e, 'response', None)
+                if response is not None:
+                    _tag_response(span, key, response, request, kwargs.get('stream'))
+                _ENDPOINTS.incr(key, 'errors')
+                raise
+            finally:
+                span.set_tag('http.attempts', request.attempts)
+                if request.auth_time:
+                    span.set_tag('http.auth_time', request.auth_time)
+                    _ENDPOINTS.observe(key, 'auth_time', request.auth_time)
+                if request.reauth:
+                    span.set_tag('http.reauth', True)
+                    _ENDPOINTS.incr(key, 'reauths')
+            _tag_response(span, key, resp, request, kwargs.get('stream'))
+            return resp
+    finally:
+        _ENDPOINTS.observe(key, 'latency', time.monotonic() - start)
+        _CURRENT_REQUEST.reset(token)
+
+
+def send_request_wrapper(self, *args, **kwargs):
+    """Wraps keystoneauth1.session.Session._send_request
+
+    Called once per attempt, including retries, redirects and the resend
+    after re-authentication.
+    """
+
+    request = _CURRENT_REQUEST.get()
+    if request is not None:
+        request.attempts += 1
+    return _Session_send_request(self, *args, **kwargs)
+
+
+def get_auth_headers_wrapper(self, *args, **kwargs):
+    """Wraps keystoneauth1.session.Session.get_auth_headers"""
+
+    request = _CURRENT_REQUEST.get()
+    if request is None:
+        return _Session_get_auth_headers(self, *args, **kwargs)
+    start = time.monotonic()
+    try:
+        return _Session_get_auth_headers(self, *args, **kwargs)
+    finally:
+        request.auth_time += time.monotonic() - start
+
+
+def invalidate_wrapper(self, *args, **kwargs):
+    """Wraps keystoneauth1.session.Session.invalidate"""
+
+    request = _CURRENT_REQUEST.get()
+    if request is not None:
+        request.reauth = True
+    return _Session_invalidate(self, *args, **kwargs)
+
+
+_WRAPPERS = (
+    ('request', request_wrapper, _REQUEST_ARGUMENTS),
+    ('_send_request', send_request_wrapper, None),
+    ('get_auth_headers', get_auth_headers_wrapper, None),
+    ('invalidate', invalidate_wrapper, None),
+)
+
+
+def bees_keystoneauth1_patch():
+    for name, wrapper, arguments in _WRAPPERS:
+        wrapping.patch(Session, name, wrapper, arguments)
+
+
+def bees_keystoneauth1_unpatch():
+    for name, _, _ in _WRAPPERS:
+        wrapping.unpatch(Session, name)
@@ -5,10 +5,13 @@
 # - keystoneclient
 
 
-from keystoneauth1.session import Session as keystoneauth1_Session
-from .keystoneauth1 import request_wrapper as r1
+from .keystoneauth1 import bees_keystoneauth1_patch, bees_keystoneauth1_unpatch
 
 
 # keystonemiddleware
 def mock_session_request():
-    setattr(keystoneauth1_Session, 'request', r1)
+    bees_keystoneauth1_patch()
+
+
+def unmock_session_request():
+    bees_keystoneauth1_unpatch()
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
 
 import sqlalchemy
 from neutron_lib.db import api
 from neutron_lib.rpc import RequestContextSerializer
 
-from .oslo_rpc import bees_rpc_patch
+from . import oslo_rpc, wrapping
+from .oslo_rpc import bees_rpc_patch, bees_rpc_unpatch, record_measurement
 from ..sql import add_tracing
 
 RequestContextSerializer_serialize_context = RequestContextSerializer.serialize_context
@@ -17,29 +19,43 @@ logger = logging.getLogger(__name__)
 
 # serialize neutron_lib
 def serialize_context_wrapper(self, context):
+    if oslo_rpc._DISABLED:
+        return RequestContextSerializer_serialize_context(self, context)
+    start = time.monotonic()
     ctxt = RequestContextSerializer_serialize_context(self, context)
+    record_measurement('serialize_context_time', time.monotonic() - start)
     if hasattr(context, 'carrier'):
         ctxt['carrier'] = context.carrier
-        logger.debug('Serialize Context Object Carrier: {}'.format(context.carrier))
+        logger.debug('Serialize Context Object Carrier: %s', context.carrier)
     return ctxt
 
 
 # unserialize neutron_lib
 def deserialize_context_wrapper(self, context):
+    if oslo_rpc._DISABLED:
+        return RequestContextSerializer_deserialize_context(self, context)
+    start = time.monotonic()
     ctxt = RequestContextSerializer_deserialize_context(self, context)
+    record_measurement('deserialize_context_time', time.monotonic() - start)
     if 'carrier' in context:
         ctxt.carrier = context['carrier']
-        logger.debug('Deserialize Context Object Carrier: {}'.format(context['carrier']))
+        logger.debug('Deserialize Context Object Carrier: %s', context['carrier'])
     return ctxt
 
 
 # RPC
 def rpc_patch():
-    setattr(RequestContextSerializer, 'serialize_context', serialize_context_wrapper)
-    setattr(RequestContextSerializer, 'deserialize_context', deserialize_context_wrapper)
+    wrapping.patch(RequestContextSerializer, 'serialize_context', serialize_context_wrapper)
+    wrapping.patch(RequestContextSerializer, 'deserialize_context', deserialize_context_wrapper)
     bees_rpc_patch()
 
 
+def rpc_unpatch():
+    wrapping.unpatch(RequestContextSerializer, 'serialize_context')
+    wrapping.unpatch(RequestContextSerializer, 'deserialize_context')
+    bees_rpc_unpatch()
+
+
 # neutron_lib
 def _set_hook_wrapper(engine):
     api._set_hook(engine)
@@ -60,14 +76,20 @@ from neutron.agent.metadata.agent import _, LOG
 from neutron.common import ipv6_utils
 from neutron.agent.metadata.agent import MetadataProxyHandler
 import webob
-import requests
 import urllib
 
+from . import http_pool, instance_lookup
+from .. import web
+
+MetadataProxyHandler_get_instance_and_tenant_id = MetadataProxyHandler._get_instance_and_tenant_id
+
 
 @webob.dec.wsgify(RequestClass=webob.Request)
 def __call__wrapper(self, req):
     try:
         LOG.debug("Request: %s", req)
+        if web._DISABLED:
+            return _handle_request(self, req)
 
         tracer = global_tracer()
         span_ctx = tracer.extract(Format.HTTP_HEADERS, req.headers)
@@ -80,19 +102,7 @@ def __call__wrapper(self, req):
             span.set_tag('http.scheme', req.scheme)
             span.set_tag('http.url', req.path)
             span.set_tag('http.headers', dict(req.headers))
-            instance_id, tenant_id = self._get_instance_and_tenant_id(req)
-            if instance_id:
-                res = self._proxy_request(instance_id, tenant_id, req)
-                if isinstance(res, webob.exc.HTTPNotFound):
-                    LOG.info("The instance: %s is not present anymore, "
-                             "skipping cache...", instance_id)
-                    instance_id, tenant_id = self._get_instance_and_tenant_id(
-                        req, skip_cache=True)
-                    if instance_id:
-                        return self._proxy_request(instance_id, tenant_id, req)
-                return res
-            else:
-                return webob.exc.HTTPNotFound()
+            return _handle_request(self, req)
     except Exception:
         LOG.exception("Unexpected error.")
         msg = _('An unknown error has occurred. '
@@ -101,6 +111,27 @@ def __call__wrapper(self, req):
         return webob.exc.HTTPInternalServerError(explanation=explanation)
 
 
+def _handle_request(self, req):
+    instance_id, tenant_id = self._get_instance_and_tenant_id(req)
+    if instance_id:
+        res = self._proxy_request(instance_id, tenant_id, req)
+        if isinstance(res, webob.exc.HTTPNotFound):
+            LOG.info("The instance: %s is not present anymore, "
+                     "skipping cache...", instance_id)
+            instance_id, tenant_id = self._get_instance_and_tenant_id(
+                req, skip_cache=True)
+            if instance_id:
+                return self._proxy_request(instance_id, tenant_id, req)
+        return res
+    else:
+        return webob.exc.HTTPNotFound()
+
+
+def _get_instance_and_tenant_id_wrapper(self, req, skip_cache=False):
+    return instance_lookup.lookup(MetadataProxyHandler_get_instance_and_tenant_id, self, req,
+                                  skip_cache=skip_cache)
+
+
 def _proxy_request(self, instance_id, tenant_id, req):
     headers = {
         'X-Forwarded-For': req.headers.get('X-Forwarded-For'),
@@ -136,11 +167,13 @@ def _proxy_request(self, instance_id, tenant_id, req):
         client_cert = (self.conf.nova_client_cert,
                        self.conf.nova_client_priv_key)
 
-    resp = requests.request(method=req.method, url=url,
-                            headers=headers,
-                            data=req.body,
-                            cert=client_cert,
-                            verify=verify_cert)
+    # kept-alive connection per nova-metadata host and certificate config
+    resp = http_pool.request(span, self.conf.nova_metadata_protocol, nova_host_port,
+                             method=req.method, url=url,
+                             headers=headers,
+                             data=req.body,
+                             cert=client_cert,
+                             verify=verify_cert)
 
     if resp.status_code == 200:
         req.response.content_type = resp.headers['content-type']
@@ -172,5 +205,13 @@ def _proxy_request(self, instance_id, tenant_id, req):
 
 
 def proxy_patch():
-    setattr(MetadataProxyHandler, '__call__', __call__wrapper)
-    setattr(MetadataProxyHandler, '_proxy_request', _proxy_request)
+    wrapping.patch(MetadataProxyHandler, '__call__', __call__wrapper)
+    wrapping.patch(MetadataProxyHandler, '_proxy_request', _proxy_request)
+    wrapping.patch(MetadataProxyHandler, '_get_instance_and_tenant_id', _get_instance_and_tenant_id_wrapper)
+
+
+def proxy_unpatch():
+    wrapping.unpatch(MetadataProxyHandler, '__call__')
+    wrapping.unpatch(MetadataProxyHandler, '_proxy_request')
+    wrapping.unpatch(MetadataProxyHandler, '_get_instance_and_tenant_id')
+    http_pool.close_sessions()
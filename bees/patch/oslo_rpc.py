@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import contextlib
 import logging
 import os
+import threading
+import time
+from contextvars import ContextVar
 
 from opentracing import global_tracer
 from opentracing.ext import tags
 from opentracing.propagation import Format
+from oslo_messaging._drivers import common as driver_common
+from oslo_messaging.exceptions import MessagingTimeout
 from oslo_messaging.rpc.client import _BaseCallContext
 from oslo_messaging.rpc.dispatcher import RPCDispatcher
+from oslo_messaging.transport import Transport
 from oslo_service.service import Launcher
 
+from . import wrapping
+from .. import stats, switches
 from ..eventlet.config import BeesConfig
 
 REPORTING_HOST = os.environ.get("REPORTING_HOST") or "127.0.0.1"
@@ -18,9 +28,123 @@ _BaseCallContext_call = _BaseCallContext.call
 _BaseCallContext_cast = _BaseCallContext.cast
 _RPCDispatcher_dispatch = RPCDispatcher.dispatch
 _Launcher_launch_service = Launcher.launch_service
+_Transport_send = Transport._send
+_serialize_msg = driver_common.serialize_msg
+
+_SEND_ARGUMENTS = wrapping.Arguments('wait_for_reply')
 
 logger = logging.getLogger(__name__)
 
+#: carrier key holding the wall-clock time the client sent the message
+SENT_AT = 'x-bees-sent-at'
+
+#: longer queue waits are attributed to clock skew between hosts
+MAX_QUEUE_WAIT = 3600
+
+# RPC method being sent or dispatched by the current thread/greenthread
+_CURRENT_METHOD = ContextVar('bees_rpc_method', default=None)
+
+_METHODS = stats.Aggregator({
+    'payload_bytes': stats.SIZE_BUCKETS,
+    'serialize_time': stats.LATENCY_BUCKETS,
+    'send_time': stats.LATENCY_BUCKETS,
+    'call_time': stats.LATENCY_BUCKETS,
+    'serialize_context_time': stats.LATENCY_BUCKETS,
+    'deserialize_context_time': stats.LATENCY_BUCKETS,
+    'queue_wait': stats.LATENCY_BUCKETS,
+})
+
+
+# client latency by (topic, server, method, call/cast)
+_TARGETS = stats.Aggregator({'latency': stats.LATENCY_BUCKETS})
+
+# RPCs sent by this process and not yet completed
+_IN_FLIGHT = 0
+_IN_FLIGHT_LOCK = threading.Lock()
+
+# cast coalescing window in seconds, None when disabled
+_COALESCE_WINDOW = None
+
+# open coalesced cast groups by (parent span id, topic, server, method)
+_COALESCED = {}
+_COALESCE_LOCK = threading.Lock()
+
+# thread (a greenthread under eventlet) finishing expired groups while
+# any are open, None when there are none
+_FLUSHER = None
+
+
+_DISABLED = False
+
+
+def disable():
+    """Call RPCs without tracing them."""
+
+    global _DISABLED
+    _DISABLED = True
+    flush_coalesced_casts()
+
+
+def enable():
+    """Trace RPCs again."""
+
+    global _DISABLED
+    _DISABLED = False
+
+
+switches.register('rpc', enable, disable)
+
+
+def _add_in_flight(delta):
+    global _IN_FLIGHT
+    with _IN_FLIGHT_LOCK:
+        _IN_FLIGHT += delta
+
+
+def in_flight():
+    """Return the number of client RPCs currently waiting on the transport."""
+
+    return _IN_FLIGHT
+
+
+def record_measurement(name, value):
+    """Tag the active RPC span with a measurement and aggregate it per method."""
+
+    span = global_tracer().active_span
+    if span is not None:
+        span.set_tag('rpc.' + name, value)
+    method = _CURRENT_METHOD.get()
+    if method is not None:
+        _METHODS.observe(method, name, value)
+
+
+def dump_statistics():
+    """Return per-method payload size, serialization/send time and
+    sent/error/timeout counters."""
+
+    return _METHODS.dump()
+
+
+def dump_target_statistics():
+    """Return client RPC latency histograms per topic, server, method and kind."""
+
+    return [dict(entry, topic=topic, server=server, method=method, kind=kind)
+            for (topic, server, method, kind), entry in _TARGETS.dump().items()]
+
+
+def timeout_rates():
+    """Return the fraction of sent RPCs that timed out, per method."""
+
+    return dict((method, float(entry.get('timeouts', 0)) / entry['sent'])
+                for method, entry in _METHODS.dump().items() if entry.get('sent'))
+
+
+def reset_statistics():
+    """Drop all aggregated per-method and per-target statistics."""
+
+    _METHODS.reset()
+    _TARGETS.reset()
+
 
 def extract_parent_span(context):
     parent_ctx = None
@@ -28,14 +152,26 @@ def extract_parent_span(context):
     try:
         if 'carrier' in context:
             carrier = context['carrier']
-            logger.debug("Parent carrier extracted:{}".format(carrier))
+            logger.debug("Parent carrier extracted: %s", carrier)
             tracer = global_tracer()
             parent_ctx = tracer.extract(format=Format.TEXT_MAP, carrier=carrier)
     except Exception as e:
-        logger.exception('Carrier extraction failed in before_dispatcher: %s' % e)
+        logger.exception('Carrier extraction failed in before_dispatcher: %s', e)
     return parent_ctx
 
 
+def _queue_wait(context):
+    """Seconds since the client sent the message, or None if unknown."""
+
+    carrier = context.get('carrier')
+    if not carrier or SENT_AT not in carrier:
+        return None
+    try:
+        return time.time() - float(carrier[SENT_AT])
+    except (TypeError, ValueError):
+        return None
+
+
 def create_child_span(target, context, method, kwargs, operation):
     """Create child span before sending RPC messaging"""
 
@@ -46,6 +182,15 @@ def create_child_span(target, context, method, kwargs, operation):
     span.set_tag(tags.SPAN_KIND, tags.SPAN_KIND_RPC_CLIENT)
     span.set_tag('rpc.method', method)
     span.set_tag('rpc.kwargs', kwargs)
+    span.set_tag('rpc.topic', target.topic)
+    if target.server:
+        span.set_tag('rpc.server', target.server)
+    if target.version:
+        span.set_tag('rpc.version', target.version)
+    if target.namespace:
+        span.set_tag('rpc.namespace', target.namespace)
+    if target.fanout:
+        span.set_tag('rpc.fanout', True)
 
     request_id = context.request_id
     if request_id:
@@ -55,36 +200,243 @@ def create_child_span(target, context, method, kwargs, operation):
     tracer.inject(span_context=span.context,
                   format=Format.TEXT_MAP,
                   carrier=carrier)
+    carrier[SENT_AT] = repr(time.time())
 
     context.carrier = carrier
-    logger.debug("Injected carrier into context object: {}".format(context.carrier))
+    logger.debug("Injected carrier into context object: %s", carrier)
 
     return span
 
 
+@contextlib.contextmanager
+def _tracked(target, method, operation):
+    """Count an RPC being sent and record its latency however it ends."""
+
+    token = _CURRENT_METHOD.set(method)
+    _METHODS.incr(method, 'sent')
+    _add_in_flight(1)
+    start = time.monotonic()
+    try:
+        yield
+    except MessagingTimeout:
+        _METHODS.incr(method, 'timeouts')
+        raise
+    except Exception:
+        _METHODS.incr(method, 'errors')
+        raise
+    finally:
+        kind = 'call' if operation == 'RPC_CALL' else 'cast'
+        _TARGETS.observe((target.topic, target.server, method, kind), 'latency', time.monotonic() - start)
+        _add_in_flight(-1)
+        _CURRENT_METHOD.reset(token)
+
+
+@contextlib.contextmanager
+def _client_span(target, context, method, kwargs, operation):
+    """Activate an RPC client span that is finished however the RPC ends.
+
+    The scope tags errors; timeouts are additionally tagged and counted.
+    """
+
+    if _COALESCED:
+        _flush_expired(time.monotonic())
+    span = create_child_span(target, context, method, kwargs, operation)
+    with _tracked(target, method, operation):
+        # active while sending, so serialization hooks can tag it
+        with global_tracer().scope_manager.activate(span, finish_on_close=True):
+            try:
+                yield span
+            except MessagingTimeout:
+                span.set_tag('rpc.timeout', True)
+                raise
+
+
+class _CastGroup(object):
+    """Casts of one method to one topic from one parent span."""
+
+    __slots__ = ('parent', 'span', 'carrier', 'started', 'count', 'total_time', 'finished_at')
+
+    def __init__(self, parent, span, carrier, started):
+        self.parent = parent  # keeps id(parent) from being reused while grouped
+        self.span = span
+        self.carrier = carrier
+        self.started = started
+        self.count = 0
+        self.total_time = 0.0
+        self.finished_at = None
+
+
+def set_cast_coalescing(window=None):
+    """Aggregate repeated casts into one span per window.
+
+    Casts of the same method to the same topic and server, made under the
+    same parent span within ``window`` seconds of the first one, share one
+    ``RPC_CAST`` span (and its carrier) tagged with ``rpc.cast_count`` and
+    ``rpc.cast_total_time``. Per-method and per-target statistics still
+    count every cast. Expired groups are finished by a background thread
+    (a greenthread under eventlet) and the next RPC, and all groups when
+    RPC tracing is disabled or the process exits. ``None`` disables
+    coalescing.
+    """
+
+    global _COALESCE_WINDOW
+    _COALESCE_WINDOW = window
+    if window is None:
+        flush_coalesced_casts()
+
+
+def flush_coalesced_casts():
+    """Finish all open coalesced cast spans."""
+
+    with _COALESCE_LOCK:
+        groups = list(_COALESCED.values())
+        _COALESCED.clear()
+    for group in groups:
+        _finish_group(group)
+
+
+def _flush_loop():
+    global _FLUSHER
+    while True:
+        with _COALESCE_LOCK:
+            if not _COALESCED:
+                _FLUSHER = None
+                return
+            window = _COALESCE_WINDOW or 0.0
+            oldest = min(group.started for group in _COALESCED.values())
+        time.sleep(min(max(oldest + window - time.monotonic(), 0.0), window) + 0.01)
+        _flush_expired(time.monotonic())
+
+
+def _start_flusher():
+    """Start the flusher unless it is running; called with _COALESCE_LOCK held."""
+
+    global _FLUSHER
+    if _FLUSHER is None:
+        _FLUSHER = threading.Thread(target=_flush_loop, name='bees-cast-flusher', daemon=True)
+        _FLUSHER.start()
+
+
+def _flush_expired(now):
+    expired = []
+    with _COALESCE_LOCK:
+        for key, group in list(_COALESCED.items()):
+            if _COALESCE_WINDOW is None or now - group.started > _COALESCE_WINDOW:
+                expired.append(_COALESCED.pop(key))
+    for group in expired:
+        _finish_group(group)
+
+
+def _finish_group(group):
+    span = group.span
+    span.set_tag('rpc.cast_count', group.count)
+    span.set_tag('rpc.cast_total_time', group.total_time)
+    span.finish(finish_time=group.finished_at)
+
+
+def _coalesced_cast(call_context, ctxt, method, kwargs, parent):
+    target = call_context.target
+    key = (id(parent), target.topic, target.server, method)
+    now = time.monotonic()
+    _flush_expired(now)
+    with _COALESCE_LOCK:
+        group = _COALESCED.get(key)
+        if group is None:
+            span = create_child_span(target, ctxt, method, kwargs, 'RPC_CAST')
+            span.set_tag('rpc.coalesced', True)
+            group = _COALESCED[key] = _CastGroup(parent, span, ctxt.carrier, now)
+            _start_flusher()
+        else:
+            # same trace context, but a fresh send time for the queue wait
+            carrier = dict(group.carrier)
+            carrier[SENT_AT] = repr(time.time())
+            ctxt.carrier = carrier
+
+    start = time.monotonic()
+    try:
+        with _tracked(target, method, 'RPC_CAST'):
+            with global_tracer().scope_manager.activate(group.span, finish_on_close=False):
+                _BaseCallContext_cast(call_context, ctxt, method, **kwargs)  # serialize_context
+    except Exception:
+        group.span.set_tag(tags.ERROR, True)
+        raise
+    finally:
+        with _COALESCE_LOCK:
+            group.count += 1
+            group.total_time += time.monotonic() - start
+            group.finished_at = time.time()
+
+
+atexit.register(flush_coalesced_casts)
+
+
 def call_wrapper(self, ctxt, method, **kwargs):
     """Wraps oslo_messaging.rpc.client._BaseCallContext.call"""
 
-    logger.debug("RPC CALL method: {}, kwargs: {}".format(method, kwargs))
-    span = create_child_span(self.target, ctxt, method, kwargs, 'RPC_CALL')
-    resp = _BaseCallContext_call(self, ctxt, method, **kwargs)  # serialize_context
-    span.set_tag('rpc.result', resp)
-    span.finish()
-    return resp
+    if _DISABLED:
+        return _BaseCallContext_call(self, ctxt, method, **kwargs)
+
+    logger.debug("RPC CALL method: %s, kwargs: %s", method, kwargs)
+    with _client_span(self.target, ctxt, method, kwargs, 'RPC_CALL') as span:
+        resp = _BaseCallContext_call(self, ctxt, method, **kwargs)  # serialize_context
+        span.set_tag('rpc.result', resp)
+        return resp
 
 
 def cast_wrapper(self, ctxt, method, **kwargs):
     """Wraps oslo_messaging.rpc.client._BaseCallContext.cast"""
 
-    logger.debug("RPC CAST method: {}, kwargs: {}".format(method, kwargs))
-    span = create_child_span(self.target, ctxt, method, kwargs, 'RPC_CAST')
-    _BaseCallContext_cast(self, ctxt, method, **kwargs)  # serialize_context
-    span.finish()
+    if _DISABLED:
+        return _BaseCallContext_cast(self, ctxt, method, **kwargs)
+
+    logger.debug("RPC CAST method: %s, kwargs: %s", method, kwargs)
+    if _COALESCE_WINDOW is not None:
+        parent = global_tracer().active_span
+        if parent is not None:
+            _coalesced_cast(self, ctxt, method, kwargs, parent)
+            return
+    with _client_span(self.target, ctxt, method, kwargs, 'RPC_CAST'):
+        _BaseCallContext_cast(self, ctxt, method, **kwargs)  # serialize_context
+
+
+def transport_send_wrapper(self, *args, **kwargs):
+    """Wraps oslo_messaging.transport.Transport._send
+
+    A call waits for the reply in ``_send``, so its duration is recorded
+    as ``call_time``; ``send_time`` only covers sends that return once the
+    message is published.
+    """
+
+    if _DISABLED:
+        return _Transport_send(self, *args, **kwargs)
+
+    name = 'call_time' if _SEND_ARGUMENTS.get(args, kwargs, 'wait_for_reply') else 'send_time'
+    start = time.monotonic()
+    try:
+        return _Transport_send(self, *args, **kwargs)
+    finally:
+        record_measurement(name, time.monotonic() - start)
+
+
+def serialize_msg_wrapper(raw_msg):
+    """Wraps oslo_messaging._drivers.common.serialize_msg"""
+
+    if _DISABLED:
+        return _serialize_msg(raw_msg)
+
+    start = time.monotonic()
+    msg = _serialize_msg(raw_msg)
+    record_measurement('serialize_time', time.monotonic() - start)
+    record_measurement('payload_bytes', len(msg[driver_common._MESSAGE_KEY]))
+    return msg
 
 
 def dispatch_wrapper(self, incoming):
     """Wraps oslo_messaging.rpc.dispatcher.RPCDispatcher"""
 
+    if _DISABLED:
+        return _RPCDispatcher_dispatch(self, incoming)
+
     message = incoming.message
     ctxt = incoming.ctxt
 
@@ -93,7 +445,7 @@ def dispatch_wrapper(self, incoming):
     kwargs = message.get('kwargs', {})
     namespace = message.get('namespace')
 
-    logger.debug("dispatch target method: {}, namespace: {}, args : {}".format(method, namespace, args))
+    logger.debug("dispatch target method: %s, namespace: %s, args: %s", method, namespace, args)
 
     tracer = global_tracer()
 
@@ -109,6 +461,16 @@ def dispatch_wrapper(self, incoming):
     request_id = ctxt.get('request_id', None)
     if request_id:
         tags_dict['request.id'] = request_id
+
+    # time spent in the broker and in the executor queue
+    queue_wait = _queue_wait(ctxt)
+    if queue_wait is not None:
+        if 0 <= queue_wait <= MAX_QUEUE_WAIT:
+            tags_dict['rpc.queue_wait'] = queue_wait
+            _METHODS.observe(method, 'queue_wait', queue_wait)
+        else:
+            tags_dict['rpc.queue_wait_skewed'] = queue_wait
+
     if incoming.msg_id:
         operation = 'RPC_CALL'  # RPC Call
     else:
@@ -116,11 +478,15 @@ def dispatch_wrapper(self, incoming):
 
     # parent_ctx = tracer.active_span or extract_parent_span(ctxt)
     parent_ctx = extract_parent_span(ctxt)
-    with tracer.start_active_span(operation_name=operation, child_of=parent_ctx, tags=tags_dict) as scope:
-        ret = _RPCDispatcher_dispatch(self, incoming)  # deserialize_context
-        scope.span.set_tag('rpc.result', ret)
-        logger.debug("Dispatch done")
-        return ret
+    token = _CURRENT_METHOD.set(method)
+    try:
+        with tracer.start_active_span(operation_name=operation, child_of=parent_ctx, tags=tags_dict) as scope:
+            ret = _RPCDispatcher_dispatch(self, incoming)  # deserialize_context
+            scope.span.set_tag('rpc.result', ret)
+            logger.debug("Dispatch done")
+            return ret
+    finally:
+        _CURRENT_METHOD.reset(token)
 
 
 def launch_service_wrapper(self, service, workers=1):
@@ -134,14 +500,14 @@ def launch_service_wrapper(self, service, workers=1):
         for obj in service._services:
             for attr in dir(obj):
                 if not attr.startswith('__'):
-                    logger.info("obj.%s = %r" % (attr, getattr(obj, attr)))
+                    logger.info("obj.%s = %r", attr, getattr(obj, attr))
         service_name = 'neutron-multiple-services'
     elif hasattr(service, 'start_listeners_method'):  # neutron-server
         service_name = service.start_listeners_method
     else:
         for attr in dir(service):
             if not attr.startswith('__'):
-                logger.info("obj.%s = %r" % (attr, getattr(service, attr)))
+                logger.info("obj.%s = %r", attr, getattr(service, attr))
         service_name = 'unknown-service'
 
     if service_name == 'Neutron':
@@ -168,8 +534,21 @@ def launch_service_wrapper(self, service, workers=1):
     _Launcher_launch_service(self, service, workers=workers)
 
 
+_WRAPPERS = (
+    (_BaseCallContext, 'call', call_wrapper, None),
+    (_BaseCallContext, 'cast', cast_wrapper, None),
+    (RPCDispatcher, 'dispatch', dispatch_wrapper, None),
+    (Transport, '_send', transport_send_wrapper, _SEND_ARGUMENTS),
+    (driver_common, 'serialize_msg', serialize_msg_wrapper, None),
+    (Launcher, 'launch_service', launch_service_wrapper, None),
+)
+
+
 def bees_rpc_patch():
-    setattr(_BaseCallContext, 'call', call_wrapper)
-    setattr(_BaseCallContext, 'cast', cast_wrapper)
-    setattr(RPCDispatcher, 'dispatch', dispatch_wrapper)
-    setattr(Launcher, 'launch_service', launch_service_wrapper)
+    for owner, name, wrapper, arguments in _WRAPPERS:
+        wrapping.patch(owner, name, wrapper, arguments)
+
+
+def bees_rpc_unpatch():
+    for owner, name, _, _ in _WRAPPERS:
+        wrapping.unpatch(owner, name)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""Installing and removing wrappers around third-party functions.
+
+Wrappers take ``(self, *args, **kwargs)`` and pass them through untouched,
+so they keep working when upstream adds or reorders parameters. The few
+arguments a wrapper reads are looked up through :class:`Arguments`, whose
+positions are resolved against the real signature once, when the wrapper
+is installed.
+"""
+
+import inspect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# (owner, name) -> the attribute the wrapper replaced
+_ORIGINALS = {}
+_LOCK = threading.Lock()
+
+
+class SignatureMismatch(TypeError):
+    """The function to wrap does not have the parameters a wrapper reads."""
+
+
+class Arguments(object):
+    """Named arguments a wrapper reads from ``*args, **kwargs``.
+
+    :param names: parameter names, looked up in the wrapped function's
+        signature (after ``self`` for methods) by :func:`patch`.
+    :param var_keyword: also require the function to take ``**kwargs``,
+        e.g. because the wrapper passes ``headers`` through them.
+    """
+
+    def __init__(self, *names, **options):
+        self.names = names
+        self.var_keyword = options.get('var_keyword', False)
+        self.positions = {}
+
+    def verify(self, function, qualname, method=True, leading=0):
+        """Resolve the positions of the names in the signature of ``function``.
+
+        :param leading: number of positional parameters (after ``self``)
+            the wrapper declares before ``*args``.
+        """
+
+        parameters = _parameters(function, method)
+        positions = {}
+        for name in self.names:
+            for index, parameter in enumerate(parameters):
+                if parameter.name == name:
+                    break
+            else:
+                raise SignatureMismatch('%s has no parameter %r' % (qualname, name))
+            if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+                if index < leading:
+                    raise SignatureMismatch('%s parameter %r is declared by the wrapper' % (qualname, name))
+                positions[name] = index - leading
+            elif parameter.kind == parameter.KEYWORD_ONLY:
+                positions[name] = None
+            else:
+                raise SignatureMismatch('%s parameter %r is variadic' % (qualname, name))
+        if self.var_keyword and not any(p.kind == p.VAR_KEYWORD for p in parameters):
+            raise SignatureMismatch('%s does not take **kwargs' % qualname)
+        self.positions = positions
+
+    def get(self, args, kwargs, name, default=None):
+        index = self.positions[name]
+        if index is not None and index < len(args):
+            return args[index]
+        return kwargs.get(name, default)
+
+
+def _parameters(function, method):
+    parameters = list(inspect.signature(function).parameters.values())
+    return parameters[1:] if method else parameters
+
+
+def _positional_names(parameters):
+    return [p.name for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+
+
+def verify(target, wrapper, qualname, method=True, arguments=None):
+    """Check that ``wrapper`` can stand in for ``target``.
+
+    The positional parameters the wrapper declares before ``*args`` must
+    be the leading parameters of the target, under the same names.
+
+    :raises SignatureMismatch: otherwise, or if ``arguments`` cannot be
+        found in the target's signature.
+    """
+
+    try:
+        declared = _positional_names(_parameters(wrapper, method))
+        expected = _positional_names(_parameters(target, method))[:len(declared)]
+    except (TypeError, ValueError):
+        # e.g. webob.dec.wsgify objects, which only take the request
+        if arguments is not None:
+            raise SignatureMismatch('cannot inspect the signature of %s' % qualname)
+        logger.debug("Not verifying the signature of %s", qualname)
+        return
+    if declared != expected:
+        raise SignatureMismatch('%s takes %s, wrapper expects %s' % (qualname, expected, declared))
+    if arguments is not None:
+        arguments.verify(target, qualname, method, leading=len(declared))
+
+
+def headers(kwargs):
+    """Return the ``headers`` dict of a call's ``**kwargs`` that is safe to add to.
+
+    Only ``kwargs['headers']`` is replaced; a dict passed by the caller is
+    copied, never modified.
+    """
+
+    caller_headers = kwargs.get('headers')
+    result = {} if caller_headers is None else dict(caller_headers)
+    kwargs['headers'] = result
+    return result
+
+
+def original(owner, name):
+    """Return the attribute a wrapper replaced, or the current one if not patched."""
+
+    with _LOCK:
+        if (owner, name) in _ORIGINALS:
+            return _ORIGINALS[(owner, name)]
+    return owner.__dict__[name] if name in vars(owner) else getattr(owner, name)
+
+
+def patch(owner, name, wrapper, arguments=None):
+    """Replace ``owner.name`` with ``wrapper``.
+
+    Patching again replaces the wrapper but keeps the first original, so
+    :func:`unpatch` always restores the unwrapped attribute.
+
+    :raises SignatureMismatch: see :func:`verify`.
+    """
+
+    target = original(owner, name)
+    qualname = '%s.%s' % (getattr(owner, '__name__', owner), name)
+    verify(target, wrapper, qualname, inspect.isclass(owner), arguments)
+    with _LOCK:
+        _ORIGINALS.setdefault((owner, name), target)
+        setattr(owner, name, wrapper)
+    logger.debug("Patched %s", qualname)
+
+
+def unpatch(owner, name):
+    """Restore ``owner.name``; a no-op if it is not patched."""
+
+    with _LOCK:
+        target = _ORIGINALS.pop((owner, name), None)
+        if target is not None:
+            setattr(owner, name, target)
+
+
+def unpatch_all():
+    """Restore every attribute replaced by :func:`patch`."""
+
+    with _LOCK:
+        patched = list(_ORIGINALS.items())
+        _ORIGINALS.clear()
+        for (owner, name), target in patched:
+            setattr(owner, name, target)
+
+
+def is_patched(owner, name):
+    with _LOCK:
+        return (owner, name) in _ORIGINALS
@@ -5,7 +5,28 @@ import inspect
 
 from opentracing import global_tracer
 
-from .utils import get_callable_name, get_class_name, getmembers, parse_obj
+from . import switches
+from .utils import LazyTraced, get_callable_name, get_class_name, get_class_functions, parse_obj
+
+
+_DISABLED = False
+
+
+def disable():
+    """Call traced functions without tracing them."""
+
+    global _DISABLED
+    _DISABLED = True
+
+
+def enable():
+    """Trace calls of traced functions again."""
+
+    global _DISABLED
+    _DISABLED = False
+
+
+switches.register('function', enable, disable)
 
 
 def trace(name, info=None, hide_args=False, hide_result=False):
@@ -21,6 +42,9 @@ def trace(name, info=None, hide_args=False, hide_result=False):
 
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
+            if _DISABLED:
+                return f(*args, **kwargs)
+
             info_ = info
             tracer = global_tracer()
 
@@ -60,61 +84,55 @@ def trace(name, info=None, hide_args=False, hide_result=False):
 
 
 def trace_cls(name, info=None, hide_args=False, hide_result=False, trace_private=False, trace_static_methods=False,
-              trace_class_methods=False):
-    """Trace decorator for instances of class."""
+              trace_class_methods=False, lazy=False):
+    """Trace decorator for instances of class.
+
+    With ``lazy``, methods of a class are traced on first access instead of
+    when the class is decorated, see :class:`~bees.utils.LazyTraced`.
+    """
 
-    def trace_checker(attr_name, to_be_wrapped):
+    def trace_checker(attr_name, wrapper):
         if attr_name.startswith("__"):
             return False
 
         if not trace_private and attr_name.startswith("_"):
             return False
 
-        if isinstance(to_be_wrapped, staticmethod):
-            if not trace_static_methods:
-                return False
-            return True
+        if wrapper is staticmethod:
+            return trace_static_methods
 
-        if isinstance(to_be_wrapped, classmethod):
-            if not trace_class_methods:
-                return False
-            return True
+        if wrapper is classmethod:
+            return trace_class_methods
 
         return True
 
+    def traced(attr):
+        return trace(name, info=info, hide_args=hide_args, hide_result=hide_result)(attr)
+
     def decorator(cls):
-        clss = cls if inspect.isclass(cls) else cls.__class__
-        mro_dicts = [c.__dict__ for c in inspect.getmro(clss)]
+        is_class = inspect.isclass(cls)
 
-        traceable_attrs = [] 
-        traceable_wrappers = [] 
+        traceable_attrs = []
+        traceable_wrappers = []
 
-        for attr_name, attr in getmembers(cls):
-            if not (inspect.ismethod(attr) or inspect.isfunction(attr)): 
+        # one pass over the MRO __dict__s; static and class methods come
+        # unwrapped, so the traced function gets the class like any other
+        for attr_name, attr, wrapper in get_class_functions(cls):
+            if not trace_checker(attr_name, wrapper):
                 continue
-            wrapped_obj = None
-            for cls_dict in mro_dicts: 
-                if attr_name in cls_dict: 
-                    wrapped_obj = cls_dict[attr_name] 
-                    break
-
-            should_wrap = trace_checker(attr_name, wrapped_obj)
-            if not should_wrap:
-                continue
-            if isinstance(wrapped_obj, staticmethod):
-                wrapper = staticmethod
-            elif isinstance(wrapped_obj, classmethod):
-                wrapper = classmethod
-            else:
-                wrapper = None
+            if not is_class:
+                attr, wrapper = getattr(cls, attr_name), None
 
-            traceable_attrs.append((attr_name, attr)) 
-            traceable_wrappers.append(wrapper) 
+            traceable_attrs.append((attr_name, attr))
+            traceable_wrappers.append(wrapper)
 
         for i, (attr_name, attr) in enumerate(traceable_attrs):
-            wrapped_method = trace(name, info=info, hide_args=hide_args, 
-                                   hide_result=hide_result)(attr) 
             wrapper = traceable_wrappers[i]
+            if lazy and is_class:
+                setattr(cls, attr_name, LazyTraced(cls, attr_name, attr, wrapper, traced))
+                continue
+
+            wrapped_method = traced(attr)
             if wrapper is not None:
                 wrapped_method = wrapper(wrapped_method)
 
@@ -146,7 +164,8 @@ class TracedMeta(type):
     >>>                        'info': None,
     >>>                        'hide_args': False,
     >>>                        'hide_result': True,
-    >>>                        'trace_private': False}
+    >>>                        'trace_private': False,
+    >>>                        'lazy': False}
     >>>
     >>>      def my_method(self, some_args):
     >>>          pass
@@ -157,7 +176,8 @@ class TracedMeta(type):
     Adding of this metaclass requires to set __trace_args__ attribute to the
     class we want to modify. __trace_args__ is the dictionary with one
     mandatory key included - "name", that will define name of action to be
-    traced - E.g. wsgi, rpc, db, etc...
+    traced - E.g. wsgi, rpc, db, etc... With 'lazy', methods are traced on
+    first access, see :class:`~bees.utils.LazyTraced`.
     """
 
     def __init__(cls, cls_name, bases, attrs):
@@ -165,6 +185,7 @@ class TracedMeta(type):
 
         trace_args = dict(getattr(cls, "__trace_args__", {}))
         trace_private = trace_args.pop("trace_private", False)
+        lazy = trace_args.pop("lazy", False)
         if "name" not in trace_args:
             raise TypeError("Please specify __trace_args__ class level "
                             "dictionary attribute with mandatory 'name' key - "
@@ -183,4 +204,8 @@ class TracedMeta(type):
             traceable_attrs.append((attr_name, attr_value))
 
         for attr_name, attr_value in traceable_attrs:
-            setattr(cls, attr_name, trace(**trace_args)(getattr(cls, attr_name)))
+            if lazy:
+                setattr(cls, attr_name, LazyTraced(cls, attr_name, attr_value, None,
+                                                   lambda attr: trace(**trace_args)(attr)))
+            else:
+                setattr(cls, attr_name, trace(**trace_args)(getattr(cls, attr_name)))
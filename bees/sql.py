@@ -1,14 +1,83 @@
 from __future__ import absolute_import
 
 import contextlib
+import functools
+import hashlib
+import random
+import re
+import threading
+import time
+import weakref
 
 from opentracing import global_tracer
 
+from . import stats, switches
+
 _DISABLED = False
 
+# engine -> listeners registered by add_tracing, so every engine is
+# instrumented exactly once however many sessions or hooks see it.
+_ENGINES = weakref.WeakKeyDictionary()
+_ENGINES_LOCK = threading.Lock()
+
+_FINGERPRINT_CACHE_SIZE = 2048
+
+_PREVIEW_ROWS = 0
+_PREVIEW_BYTES = 1024
+
+_PARAMS_SAMPLE = 3
+_PARAMS_SAMPLE_BYTES = 1024
+
+# slow-query-only mode: None traces every query
+_SLOW_QUERY_THRESHOLD = None
+_SAMPLE_RATE = 0.0
+_SAMPLE_RATES = {}
+
+_STATEMENTS = stats.Aggregator({
+    'latency': stats.LATENCY_BUCKETS,
+    'rows': stats.SIZE_BUCKETS,
+    'batch_latency': stats.LATENCY_BUCKETS,
+    'batch_size': stats.SIZE_BUCKETS,
+})
+
+# connection pool and transaction instrumentation
+_TRACE_POOL = False
+
+_POOL = stats.Aggregator({
+    'checkout_wait': stats.LATENCY_BUCKETS,
+    'checkout_hold': stats.LATENCY_BUCKETS,
+    'connect': stats.LATENCY_BUCKETS,
+    'transaction': stats.LATENCY_BUCKETS,
+})
+
+# keys stored in the connection record ``info`` dictionary
+_CONNECT_START = 'bees.connect_start'
+_CHECKOUT_WAIT = 'bees.checkout_wait'
+_CHECKOUT_TIME = 'bees.checkout_time'
+_TRANSACTION_SPAN = 'bees.transaction_span'
+
+_NORMALIZERS = [
+    # comments
+    (re.compile(r'/\*.*?\*/|--[^\n]*', re.S), ' '),
+    # string literals
+    (re.compile(r"[nN]?'(?:[^'\\]|\\.|'')*'"), '?'),
+    # numeric and hex literals not part of an identifier
+    (re.compile(r'(?<![\w$.])(?:0x[0-9a-fA-F]+|[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\b'), '?'),
+    # driver placeholders: %s, %(name)s, :name, $1, ?
+    (re.compile(r'%\(\w+\)s|%s|(?<![\w:]):\w+|\$\d+'), '?'),
+    (re.compile(r'\s+'), ' '),
+    # IN lists, including sqlalchemy expanding parameters
+    (re.compile(r'\bIN \( ?(?:\?|\(?__\[POSTCOMPILE_\w+\]\)?)(?: ?, ?\?)* ?\)', re.I), 'IN (?+)'),
+    # multi-row VALUES
+    (re.compile(r'(\( ?\?(?: ?, ?\?)* ?\))(?: ?, ?\( ?\?(?: ?, ?\?)* ?\))+'), r'\1, ...'),
+]
+
 
 def disable():
-    """Disable tracing of all DB queries. Reduce a lot size of profiles."""
+    """Disable tracing of all DB queries. Reduce a lot size of profiles.
+
+    Instrumented engines keep their listeners, which skip every query.
+    """
 
     global _DISABLED
     _DISABLED = True
@@ -21,29 +90,200 @@ def enable():
     _DISABLED = False
 
 
-def _before_cursor_execute():
-    """Add listener that will send trace info before query is executed."""
+switches.register('sql', enable, disable)
 
-    def handler(conn, cursor, statement, params, context, executemany):
 
-        if context.compiled is not None:
-            stmt_obj = context.compiled.statement
-            name = stmt_obj.__visit_name__
-        else:
-            name = 'other'
+def set_slow_query_mode(threshold, sample_rate=0.0, sample_rates=None):
+    """Only create spans for slow, failed or sampled queries.
 
-        parent_span = getattr(conn, '_parent_span', None)
-        tracer = global_tracer()
-        span = tracer.start_span(operation_name=name, child_of=parent_span)
+    Every query is still aggregated, but ``before_cursor_execute`` only
+    records a timestamp and the span is materialized afterwards when the
+    query took at least ``threshold`` seconds, raised, or was picked by
+    ``sample_rate``. ``sample_rates`` maps fingerprint ids to their own
+    rate. These spans also carry the normalized ``db.statement``; others
+    only its fingerprint, whose text is in dump_statistics().
+    ``threshold=None`` goes back to tracing every query.
+    """
 
-        span.set_tag('db.statement', statement)
+    global _SLOW_QUERY_THRESHOLD, _SAMPLE_RATE, _SAMPLE_RATES
+    _SLOW_QUERY_THRESHOLD = threshold
+    _SAMPLE_RATE = sample_rate
+    _SAMPLE_RATES = dict(sample_rates or {})
+
+
+def _sampled(fingerprint_id):
+    rate = _SAMPLE_RATES.get(fingerprint_id, _SAMPLE_RATE)
+    return rate > 0 and random.random() < rate
+
+
+def set_pool_tracing(enabled=True):
+    """Also instrument the pool and transactions of engines passed to add_tracing.
+
+    Pool checkout wait, checkout hold and connect times are aggregated per
+    engine (see dump_pool_statistics) and every transaction gets a span
+    that parents its query spans.
+    """
+
+    global _TRACE_POOL
+    _TRACE_POOL = enabled
+
+
+def dump_pool_statistics():
+    """Return per-engine pool wait/hold/connect and transaction statistics."""
+
+    return _POOL.dump()
+
+
+def reset_pool_statistics():
+    """Drop all aggregated pool statistics."""
+
+    _POOL.reset()
+
+
+def set_result_preview(rows=0, max_bytes=1024):
+    """Tag spans with a preview of the first ``rows`` result rows.
+
+    DB-API has no way to look at rows without consuming them, so the
+    preview is only rendered from the row buffer of drivers that fetch the
+    whole result on execute (PyMySQL and mysqlclient buffered cursors);
+    other cursors get no preview. It is truncated to ``max_bytes`` bytes
+    of UTF-8. ``rows=0`` disables it.
+    """
+
+    global _PREVIEW_ROWS, _PREVIEW_BYTES
+    _PREVIEW_ROWS = rows
+    _PREVIEW_BYTES = max_bytes
+
+
+def set_executemany_sample(size=3, max_bytes=1024):
+    """Tag executemany spans with the first ``size`` parameter sets.
+
+    The sample is truncated to ``max_bytes``; ``size=0`` disables it.
+    """
+
+    global _PARAMS_SAMPLE, _PARAMS_SAMPLE_BYTES
+    _PARAMS_SAMPLE = size
+    _PARAMS_SAMPLE_BYTES = max_bytes
+
+
+def _render_rows(rows, limit, max_bytes):
+    parts = []
+    size = len(b'[, ...]')
+    for row in rows[:limit]:
+        part = repr(row)
+        size += len(part.encode('utf-8', 'replace')) + 2
+        if size > max_bytes:
+            parts.append('...')
+            break
+        parts.append(part)
+    return '[%s]' % ', '.join(parts)
+
+
+def _result_preview(cursor):
+    # the row buffer of PyMySQL and mysqlclient (buffered) cursors
+    buffered = getattr(cursor, '_rows', None)
+    if not isinstance(buffered, (list, tuple)) or not buffered:
+        return None
+    return _render_rows(buffered, _PREVIEW_ROWS, _PREVIEW_BYTES)
+
+
+def _tag_batch(span, params, elapsed):
+    batch_size = len(params)
+    span.set_tag('db.executemany', True)
+    span.set_tag('db.batch_size', batch_size)
+    if batch_size:
+        span.set_tag('db.row_latency', elapsed / batch_size)
+    if _PARAMS_SAMPLE:
+        span.set_tag('db.params_sample', _render_rows(params, _PARAMS_SAMPLE, _PARAMS_SAMPLE_BYTES))
+
+
+@functools.lru_cache(maxsize=_FINGERPRINT_CACHE_SIZE)
+def fingerprint(statement):
+    """Normalize a SQL statement and return (fingerprint_id, normalized).
+
+    Literals and placeholders are replaced by ``?`` and IN-lists and
+    multi-row VALUES are collapsed, so statements differing only in their
+    parameters share a fingerprint.
+    """
+
+    normalized = statement
+    for pattern, replacement in _NORMALIZERS:
+        normalized = pattern.sub(replacement, normalized)
+    normalized = normalized.strip()
+    fingerprint_id = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+    return fingerprint_id, normalized
+
+
+def dump_statistics():
+    """Return per-fingerprint query count, latency and row statistics."""
+
+    return _STATEMENTS.dump()
+
+
+def reset_statistics():
+    """Drop all aggregated per-fingerprint statistics."""
+
+    _STATEMENTS.reset()
+
+
+def _parent_span(conn):
+    """Parent queries to their transaction or the caller's active span.
+
+    Both are looked up when the query runs, so concurrent greenthreads
+    sharing an engine never see each other's spans.
+    """
+
+    if _TRACE_POOL:
+        transaction = conn.info.get(_TRANSACTION_SPAN)
+        if transaction is not None:
+            return transaction[0]
+    return global_tracer().active_span
+
+
+def _start_span(conn, statement, context, start_time=None):
+    if context.compiled is not None:
+        stmt_obj = context.compiled.statement
+        name = stmt_obj.__visit_name__
+    else:
+        name = 'other'
+
+    parent_span = _parent_span(conn)
+    tracer = global_tracer()
+    span = tracer.start_span(operation_name=name, child_of=parent_span, start_time=start_time)
+
+    span.set_tag('db.fingerprint', fingerprint(statement)[0])
+
+    span.set_tag('sqlalchemy.dialect', context.dialect.name)
+    span.set_tag('component', 'sqlalchemy')
+    span.set_tag('db.type', 'sql')
+
+    return span
 
-        span.set_tag('sqlalchemy.dialect', context.dialect.name)
-        span.set_tag('component', 'sqlalchemy')
-        span.set_tag('db.type', 'sql')
-        span.set_tag('db.params', params)
 
-        context._span = span
+def _start_late_span(conn, statement, context):
+    """Materialize the span of a query that has already run."""
+
+    elapsed = time.monotonic() - context._start_time
+    span = _start_span(conn, statement, context, start_time=time.time() - elapsed)
+    span.set_tag('db.slow_query', _SLOW_QUERY_THRESHOLD is not None and elapsed >= _SLOW_QUERY_THRESHOLD)
+    span.set_tag('db.statement', fingerprint(statement)[1])
+    return span
+
+
+def _before_cursor_execute():
+    """Add listener that will send trace info before query is executed."""
+
+    def handler(conn, cursor, statement, params, context, executemany):
+        context._span = None
+        if _DISABLED:
+            # after_cursor_execute and handle_error skip untimed queries
+            context._start_time = None
+            return
+        context._start_time = time.monotonic()
+        if _SLOW_QUERY_THRESHOLD is not None:
+            return
+
+        context._span = _start_span(conn, statement, context)
 
     return handler
 
@@ -52,56 +292,226 @@ def _after_cursor_execute():
     """Add listener that will send trace info after query is executed."""
 
     def handler(conn, cursor, statement, params, context, executemany):
-        span = getattr(context, '_span', None)
-        if span is None:
+        if getattr(context, '_start_time', None) is None:
             return
 
-        span.set_tag('db.result', str(cursor._rows))
+        rowcount = cursor.rowcount
+        elapsed = _record_statement(statement, params, context, executemany, rowcount)
+
+        span = context._span
+        if span is None:
+            if (_SLOW_QUERY_THRESHOLD is None or elapsed < _SLOW_QUERY_THRESHOLD
+                    and not _sampled(fingerprint(statement)[0])):
+                return
+            span = _start_late_span(conn, statement, context)
+
+        span.set_tag('db.rowcount', rowcount)
+        if executemany:
+            _tag_batch(span, params, elapsed)
+        if cursor.description is not None:
+            span.set_tag('db.columns', len(cursor.description))
+        if _PREVIEW_ROWS:
+            preview = _result_preview(cursor)
+            if preview is not None:
+                span.set_tag('db.result', preview)
         span.finish()
 
     return handler
 
 
+def _record_statement(statement, params, context, executemany, rowcount):
+    elapsed = time.monotonic() - context._start_time
+    fingerprint_id, normalized = fingerprint(statement)
+    if executemany:
+        _STATEMENTS.observe(fingerprint_id, 'batch_latency', elapsed)
+        _STATEMENTS.observe(fingerprint_id, 'batch_size', len(params))
+    else:
+        _STATEMENTS.observe(fingerprint_id, 'latency', elapsed)
+    if rowcount is not None and rowcount >= 0:
+        _STATEMENTS.observe(fingerprint_id, 'rows', rowcount)
+    _STATEMENTS.label(fingerprint_id, 'statement', normalized)
+    return elapsed
+
+
 def _handle_error(exception_context):
     """Handle SQLAlchemy errors"""
 
-    span = getattr(exception_context, '_span', None)
-    if span is None:
+    context = exception_context.execution_context
+    if getattr(context, '_start_time', None) is None:
         return
 
-    original_exception = str(exception_context.original_exception)
-    chained_exception = str(exception_context.chained_exception)
+    statement = exception_context.statement
+    _STATEMENTS.incr(fingerprint(statement)[0], 'errors')
 
+    span = context._span
+    if span is None:
+        span = _start_late_span(exception_context.connection, statement, context)
+    if context.executemany:
+        _tag_batch(span, exception_context.parameters, time.monotonic() - context._start_time)
+
+    original_exception = str(exception_context.original_exception)
     span.set_tag('sqlalchemy.original_exception', original_exception)
-    span.set_tag('sqlalchemy.chained_exception', chained_exception)
+
+    # removed in SQLAlchemy 1.4
+    chained_exception = getattr(exception_context, 'chained_exception', None)
+    if chained_exception is not None:
+        span.set_tag('sqlalchemy.chained_exception', str(chained_exception))
     span.set_tag('error', 'true')
 
     span.finish()
 
 
+def _wrap_pool(engine):
+    """Time how long pool.connect() waits for a connection."""
+
+    pool = engine.pool
+    key = repr(engine.url)
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.monotonic()
+        connection = connect()
+        wait = time.monotonic() - start
+        _POOL.observe(key, 'checkout_wait', wait)
+        connection.info[_CHECKOUT_WAIT] = wait
+        return connection
+
+    pool.connect = timed_connect
+
+
+def _unwrap_pool(engine):
+    engine.pool.__dict__.pop('connect', None)
+
+
+def _pool_listeners(engine):
+    # listeners must not reference the engine: the registry holds them
+    # and it is keyed weakly on the engine
+    key = repr(engine.url)
+
+    def do_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info[_CONNECT_START] = time.monotonic()
+
+    def on_connect(dbapi_connection, connection_record):
+        start = connection_record.info.pop(_CONNECT_START, None)
+        if start is not None:
+            _POOL.observe(key, 'connect', time.monotonic() - start)
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info[_CHECKOUT_TIME] = time.monotonic()
+
+    def on_checkin(dbapi_connection, connection_record):
+        if connection_record is None:
+            return
+        info = connection_record.info
+        start = info.pop(_CHECKOUT_TIME, None)
+        if start is not None:
+            _POOL.observe(key, 'checkout_hold', time.monotonic() - start)
+        # a transaction neither committed nor rolled back through the engine
+        _end_transaction(key, info, 'abandoned')
+
+    def on_begin(conn):
+        if _DISABLED:
+            return
+        tracer = global_tracer()
+        span = tracer.start_span(operation_name='transaction', child_of=_parent_span(conn))
+        span.set_tag('component', 'sqlalchemy')
+        span.set_tag('db.type', 'sql')
+        span.set_tag('db.pool.checkout_wait', conn.info.get(_CHECKOUT_WAIT))
+        checkedout = getattr(conn.engine.pool, 'checkedout', None)
+        if checkedout is not None:
+            span.set_tag('db.pool.checked_out', checkedout())
+        conn.info[_TRANSACTION_SPAN] = (span, time.monotonic())
+
+    def on_commit(conn):
+        _end_transaction(key, conn.info, 'commit')
+
+    def on_rollback(conn):
+        _end_transaction(key, conn.info, 'rollback')
+
+    def on_engine_disposed(disposed):
+        # dispose() replaces the pool; instrument the new one
+        _wrap_pool(disposed)
+
+    return [
+        ("do_connect", do_connect),
+        ("connect", on_connect),
+        ("checkout", on_checkout),
+        ("checkin", on_checkin),
+        ("begin", on_begin),
+        ("commit", on_commit),
+        ("rollback", on_rollback),
+        ("engine_disposed", on_engine_disposed),
+    ]
+
+
+def _end_transaction(key, info, outcome):
+    started = info.pop(_TRANSACTION_SPAN, None)
+    if started is None:
+        return
+
+    span, start = started
+    _POOL.observe(key, 'transaction', time.monotonic() - start)
+    _POOL.incr(key, outcome)
+    span.set_tag('db.transaction', outcome)
+    span.finish()
+
+
 def add_tracing(sqlalchemy, engine):
-    """Add tracing to all sqlalchemy calls."""
+    """Add tracing to all sqlalchemy calls.
+
+    Calling it again for an already instrumented engine is a no-op. The
+    listeners are installed while tracing is disabled too, and do nothing
+    until it is enabled.
+    """
+
+    with _ENGINES_LOCK:
+        if engine in _ENGINES:
+            return
+
+        listeners = [
+            ("before_cursor_execute", _before_cursor_execute()),
+            ("after_cursor_execute", _after_cursor_execute()),
+            ("handle_error", _handle_error),
+        ]
+        if _TRACE_POOL:
+            listeners.extend(_pool_listeners(engine))
+            _wrap_pool(engine)
+
+        for identifier, fn in listeners:
+            sqlalchemy.event.listen(engine, identifier, fn)
+        _ENGINES[engine] = listeners
+
+
+def remove_tracing(sqlalchemy, engine):
+    """Remove the listeners installed by add_tracing from an engine."""
+
+    with _ENGINES_LOCK:
+        listeners = _ENGINES.pop(engine, None)
+        if listeners is None:
+            return
+
+        for identifier, fn in listeners:
+            sqlalchemy.event.remove(engine, identifier, fn)
+        _unwrap_pool(engine)
+
+
+def instrumented_engines():
+    """Return the number of engines currently instrumented."""
 
-    if not _DISABLED:
-        sqlalchemy.event.listen(engine, "before_cursor_execute", _before_cursor_execute())
-        sqlalchemy.event.listen(engine, "after_cursor_execute", _after_cursor_execute())
-        sqlalchemy.event.listen(engine, "handle_error", _handle_error)
+    return len(_ENGINES)
 
 
 def wrap_parent(sqlalchemy, session):
-    """DEPRECATED"""
+    """DEPRECATED: query spans are parented to the active span."""
 
     sqlalchemy.event.listen(session, 'after_begin', _after_begin_handler)
 
 
 def _after_begin_handler(session, transaction, conn):
-    """DEPRECATED"""
+    """DEPRECATED: query spans are parented to the active span."""
 
     if getattr(session, '_traced', False):
         conn._traced = True
-        parent_span = getattr(session, '_parent_span', None)
-        if parent_span is not None:
-            conn._parent_span = parent_span
 
 
 @contextlib.contextmanager
@@ -110,8 +520,6 @@ def wrap_session(sqlalchemy, session):
 
     with session as sess:
         if not getattr(sess, "_traced", False):
-            parent_span = global_tracer().active_span
-            sess.bind._parent_span = parent_span
             sess._traced = True
             add_tracing(sqlalchemy, sess.bind)
         yield sess
@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+
+import bisect
+import threading
+
+#: Latency bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#: Size bucket upper bounds, for row counts, bytes and batch sizes.
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram(object):
+    """Fixed-bucket histogram.
+
+    Observing a value is one bisect and a few additions, so it is cheap
+    enough to be updated on every traced call. Percentiles are estimated
+    as the upper bound of the bucket they fall in.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0 < q <= 100)."""
+
+        if not self.count:
+            return None
+        rank = self.count * q / 100.0
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if i == len(self.bounds):
+                    return self.max
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': [(bound, count) for bound, count in
+                        zip(self.bounds + (float('inf'),), self.counts) if count],
+        }
+
+
+class Aggregator(object):
+    """Thread-safe in-process aggregation of histograms and counters by key.
+
+    :param histograms: mapping of histogram name to its bucket bounds.
+    """
+
+    def __init__(self, histograms):
+        self.histograms = dict(histograms)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ({}, {}, {})
+        return entry
+
+    def observe(self, key, name, value):
+        with self._lock:
+            histograms = self._entry(key)[2]
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(self.histograms[name])
+            histogram.observe(value)
+
+    def incr(self, key, name, amount=1):
+        with self._lock:
+            counters = self._entry(key)[1]
+            counters[name] = counters.get(name, 0) + amount
+
+    def label(self, key, name, value):
+        """Attach a descriptive value (e.g. a statement text) to a key."""
+
+        with self._lock:
+            self._entry(key)[0][name] = value
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def dump(self):
+        """Return a snapshot of all entries as plain dictionaries."""
+
+        with self._lock:
+            result = {}
+            for key, (labels, counters, histograms) in self._entries.items():
+                entry = dict(labels)
+                entry.update(counters)
+                for name, histogram in histograms.items():
+                    entry[name] = histogram.to_dict()
+                result[key] = entry
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
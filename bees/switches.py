@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""Turn instrumentation on and off at runtime, per subsystem.
+
+Every instrumented module keeps a module-level ``_DISABLED`` flag with
+``enable()``/``disable()`` functions, as :mod:`bees.web` and
+:mod:`bees.sql` always did, and registers them here under a subsystem
+name. A disabled wrapper checks that one flag and calls straight through
+to the original callable, so instrumentation can stay installed in
+production and be switched on while investigating.
+
+Subsystems:
+
+* ``function``: :func:`bees.decorate.trace`, :func:`bees.profiler.trace`
+  and everything traced through them (``trace_cls``, the metaclasses)
+* ``web``: the WSGI/ASGI middlewares and the neutron metadata proxy
+* ``sql``: queries and transactions of instrumented engines
+* ``rpc``: oslo.messaging clients, dispatchers and context serializers
+* ``http``: keystoneauth1 sessions
+
+The state can be reloaded from a control file of ``subsystem = on|off``
+lines (``all`` sets every subsystem; ``#`` starts a comment), on a signal
+with :func:`install_signal_handler` or by polling with :func:`watch`::
+
+    # /etc/bees/switches
+    all = off
+    rpc = on
+"""
+
+import logging
+import os
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+SUBSYSTEMS = ('function', 'web', 'sql', 'rpc', 'http')
+
+_ALL = 'all'
+_ON = ('on', 'true', 'yes', '1', 'enabled')
+_OFF = ('off', 'false', 'no', '0', 'disabled')
+
+# subsystem -> [(enable, disable)] of the modules registered so far
+_HANDLERS = {}
+
+# subsystem -> last requested state, applied to modules registered later
+_STATE = {}
+
+_LOCK = threading.RLock()
+
+
+def register(subsystem, enable, disable):
+    """Register a module's ``enable``/``disable`` functions for ``subsystem``.
+
+    A state set before the module was imported is applied immediately.
+    """
+
+    if subsystem not in SUBSYSTEMS:
+        raise ValueError("Unknown subsystem %r, expected one of %s" % (subsystem, ', '.join(SUBSYSTEMS)))
+    with _LOCK:
+        _HANDLERS.setdefault(subsystem, []).append((enable, disable))
+        enabled = _STATE.get(subsystem)
+    if enabled is not None:
+        (enable if enabled else disable)()
+
+
+def _subsystems(subsystem):
+    if subsystem is None or subsystem == _ALL:
+        return SUBSYSTEMS
+    if subsystem not in SUBSYSTEMS:
+        raise ValueError("Unknown subsystem %r, expected one of %s" % (subsystem, ', '.join(SUBSYSTEMS)))
+    return (subsystem,)
+
+
+def set_enabled(subsystem, enabled):
+    """Turn ``subsystem`` (None or ``'all'`` for every one) on or off."""
+
+    with _LOCK:
+        for name in _subsystems(subsystem):
+            _STATE[name] = enabled
+            for enable, disable in _HANDLERS.get(name, ()):
+                (enable if enabled else disable)()
+    logger.info("Instrumentation of %s %s", subsystem or _ALL, 'enabled' if enabled else 'disabled')
+
+
+def enable(subsystem=None):
+    set_enabled(subsystem, True)
+
+
+def disable(subsystem=None):
+    set_enabled(subsystem, False)
+
+
+def is_enabled(subsystem):
+    """Return the last state set for ``subsystem``; on unless turned off."""
+
+    return _STATE.get(subsystem, True)
+
+
+def state():
+    return dict((name, is_enabled(name)) for name in SUBSYSTEMS)
+
+
+def _parse(text):
+    """Return ``[(subsystem, enabled)]`` in file order, skipping bad lines."""
+
+    settings = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        name, sep, value = line.partition('=')
+        name, value = name.strip().lower(), value.strip().lower()
+        if not sep or (name != _ALL and name not in SUBSYSTEMS) or value not in _ON + _OFF:
+            logger.warning("Ignoring line %d of the switch file: %r", number, line)
+            continue
+        settings.append((name, value in _ON))
+    return settings
+
+
+def load(path):
+    """Apply the switch file at ``path``; a missing file changes nothing.
+
+    :returns: the resulting state of every subsystem.
+    """
+
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        logger.debug("No switch file at %s", path)
+        return state()
+    for name, enabled in _parse(text):
+        set_enabled(name, enabled)
+    return state()
+
+
+def _start_reloader(path, interval, changed):
+    """Load ``path`` now and again whenever ``changed()`` returns true,
+    checked every ``interval`` seconds from a daemon thread (a greenthread
+    once eventlet has monkey patched ``threading``).
+
+    :returns: an event that stops the thread when set.
+    """
+
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            if changed():
+                try:
+                    load(path)
+                except Exception:
+                    logger.exception("Failed to reload the switch file %s", path)
+
+    load(path)
+    threading.Thread(target=run, name='bees-switches', daemon=True).start()
+    return stop
+
+
+def install_signal_handler(path, signum=signal.SIGUSR2, interval=1.0):
+    """Reload the switch file at ``path`` after ``signum`` is received.
+
+    The handler only records the signal: it can interrupt any frame, so
+    the file is read and the switches are flipped by a thread checking
+    for a recorded signal every ``interval`` seconds. Must be called from
+    the main thread. The file is loaded once now.
+
+    :returns: an event that stops the reloading thread when set.
+    """
+
+    requested = [False]
+
+    def handler(signum, frame):
+        requested[0] = True
+
+    def changed():
+        if not requested[0]:
+            return False
+        requested[0] = False
+        return True
+
+    signal.signal(signum, handler)
+    return _start_reloader(path, interval, changed)
+
+
+def watch(path, interval=5.0):
+    """Reload the switch file at ``path`` when its modification time changes.
+
+    The file is loaded once now and checked every ``interval`` seconds.
+
+    :returns: an event that stops the watcher when set.
+    """
+
+    def mtime():
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    last = [mtime()]
+
+    def changed():
+        current = mtime()
+        if current == last[0]:
+            return False
+        last[0] = current
+        return True
+
+    return _start_reloader(path, interval, changed)
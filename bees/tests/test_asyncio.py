@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+
+import asyncio
+from unittest import TestCase, mock
+
+from bees.asyncio.scope_manager import ContextVarsScopeManager
+
+
+class TestContextVarsScopeManager(TestCase):
+
+    def test_activate_close(self):
+        manager = ContextVarsScopeManager()
+        span = mock.MagicMock()
+
+        scope = manager.activate(span, finish_on_close=True)
+        self.assertIs(manager.active, scope)
+
+        scope.close()
+        self.assertIsNone(manager.active)
+        span.finish.assert_called_once()
+
+    def test_nested_restore(self):
+        manager = ContextVarsScopeManager()
+        parent = manager.activate(mock.MagicMock(), finish_on_close=False)
+        child = manager.activate(mock.MagicMock(), finish_on_close=False)
+
+        # closing a scope that is not active is a no-op
+        parent.close()
+        self.assertIs(manager.active, child)
+
+        child.close()
+        self.assertIs(manager.active, parent)
+        parent.close()
+        self.assertIsNone(manager.active)
+
+    def test_propagates_across_await(self):
+        manager = ContextVarsScopeManager()
+        span = mock.MagicMock()
+
+        async def child():
+            await asyncio.sleep(0)
+            return manager.active.span
+
+        async def other():
+            # tasks created outside the scope do not see it
+            return manager.active
+
+        async def parent():
+            outsider = asyncio.ensure_future(other())
+            with manager.activate(span, finish_on_close=False):
+                seen = await asyncio.gather(child(), asyncio.ensure_future(child()))
+            return seen, await outsider
+
+        seen, outsider = asyncio.run(parent())
+        self.assertEqual(seen, [span, span])
+        self.assertIsNone(outsider)
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, mock
+
+import eventlet
+from eventlet import greenpool, greenthread
+from opentracing.mocktracer import MockTracer
+
+from bees.eventlet import greenthreads
+from bees.eventlet.scope_manager import EventletScopeManager
+
+
+class TestSpawnPropagation(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer(scope_manager=EventletScopeManager())
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        greenthreads.patch_spawn()
+        self.addCleanup(greenthreads.unpatch_spawn)
+
+    def _active_span(self):
+        scope = self.tracer.scope_manager.active
+        return None if scope is None else scope.span
+
+    def test_spawn(self):
+        with self.tracer.start_active_span("sync_routers") as scope:
+            thread = eventlet.spawn(self._active_span)
+            delayed = greenthread.spawn_after(0, self._active_span)
+        self.assertIs(thread.wait(), scope.span)
+        self.assertIs(delayed.wait(), scope.span)
+        # the parent span is not finished by the children
+        self.assertEqual(len(self.tracer.finished_spans()), 1)
+
+    def test_green_pool(self):
+        pool = greenpool.GreenPool(4)
+        seen = []
+
+        def work(i):
+            with self.tracer.start_active_span("process_router_%d" % i):
+                eventlet.sleep(0)
+            seen.append(self._active_span())
+
+        with self.tracer.start_active_span("sync_routers") as scope:
+            for i in range(4):
+                pool.spawn_n(work, i)
+            results = list(pool.imap(lambda _: self._active_span(), range(4)))
+        pool.waitall()
+
+        self.assertEqual(results, [scope.span] * 4)
+        self.assertEqual(seen, [scope.span] * 4)
+        children = [span for span in self.tracer.finished_spans() if span.operation_name != "sync_routers"]
+        self.assertEqual(len(children), 4)
+        self.assertTrue(all(span.parent_id == scope.span.context.span_id for span in children))
+
+    def test_without_active_span(self):
+        def work():
+            pass
+
+        with mock.patch.object(greenthreads, "_spawn") as spawn:
+            eventlet.spawn(work)
+        spawn.assert_called_once_with(work)
+        self.assertIsNone(eventlet.spawn(self._active_span).wait())
+
+    def test_unpatch(self):
+        greenthreads.unpatch_spawn()
+        with self.tracer.start_active_span("sync_routers"):
+            self.assertIsNone(eventlet.spawn(self._active_span).wait())
+        self.assertIs(eventlet.spawn, greenthreads._spawn)
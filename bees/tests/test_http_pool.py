@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, mock
+
+from opentracing.mocktracer import MockTracer
+
+from bees.patch import http_pool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/cookie':
+            body = self.headers.get('Cookie', 'none').encode()
+        else:
+            body = b'instance-id'
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'tenant=t1; Path=/')
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpPool(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.netloc = '127.0.0.1:%d' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(http_pool.close_sessions)
+        self.tracer = MockTracer()
+
+    def _get(self):
+        span = self.tracer.start_span('MetadataProxyHandler')
+        resp = http_pool.request(span, 'http', self.netloc, method='GET',
+                                 url='http://%s/latest/meta-data/instance-id' % self.netloc)
+        span.finish()
+        self.assertEqual(resp.content, b'instance-id')
+        return span
+
+    def test_connection_reuse(self):
+        first = self._get()
+        second = self._get()
+
+        self.assertFalse(first.tags['http.connection_reused'])
+        self.assertGreater(first.tags['http.connect_time'], 0)
+        self.assertTrue(second.tags['http.connection_reused'])
+        self.assertNotIn('http.connect_time', second.tags)
+        self.assertGreaterEqual(second.tags['http.response_time'], 0)
+
+    def test_sessions_by_config(self):
+        session = http_pool.session_for('http', self.netloc)
+        self.assertIs(http_pool.session_for('http', self.netloc), session)
+        self.assertIsNot(http_pool.session_for('http', self.netloc, cert=('c', 'k')), session)
+
+    def test_sessions_bounded(self):
+        with mock.patch.object(http_pool, 'MAX_SESSIONS', 2):
+            first = http_pool.session_for('http', 'nova-1:8775')
+            with mock.patch.object(first, 'close') as close:
+                http_pool.session_for('http', 'nova-2:8775')
+                http_pool.session_for('http', 'nova-3:8775')
+            close.assert_called_once_with()
+        self.assertEqual(len(http_pool._SESSIONS), 2)
+
+    def test_evicted_session_in_use(self):
+        with mock.patch.object(http_pool, 'MAX_SESSIONS', 1):
+            pooled = http_pool._acquire(('http', 'nova-1:8775', True, None))
+            with mock.patch.object(pooled.session, 'close') as close:
+                http_pool.session_for('http', 'nova-2:8775')
+                close.assert_not_called()
+                http_pool._release(pooled)
+            close.assert_called_once_with()
+
+    def test_no_cookies(self):
+        url = 'http://%s/cookie' % self.netloc
+        http_pool.request(None, 'http', self.netloc, method='GET', url=url)
+        resp = http_pool.request(None, 'http', self.netloc, method='GET', url=url)
+        self.assertEqual(resp.content, b'none')
+        self.assertEqual(len(http_pool.session_for('http', self.netloc).cookies), 0)
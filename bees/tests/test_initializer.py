@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 
 from datetime import datetime
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from opentracing import global_tracer
 
+from bees.asyncio.scope_manager import ContextVarsScopeManager
+from bees.eventlet.leak_detector import LeakDetectingScopeManager
 from bees.initializer import init_from_conf
 
 
@@ -15,3 +17,24 @@ class TestInitializer(TestCase):
         name = 'test-profiler ' + now.strftime('%H:%M:%S')
         tracer = init_from_conf(conf='../config.yaml', service=name)
         assert tracer == global_tracer()
+
+    @mock.patch("bees.initializer.BeesConfig")
+    def test_contextvars_scope_manager_with_eventlet(self, config):
+        init_from_conf(service='test-contextvars', eventlet=True, contextvars_scope_manager=True)
+        self.assertIsInstance(config.call_args[1]['scope_manager'], ContextVarsScopeManager)
+
+    def test_exclusive_scope_managers(self):
+        self.assertRaises(ValueError, init_from_conf, service='test-exclusive', eventlet=True,
+                          eventlet_scope_manager=True, contextvars_scope_manager=True)
+
+    @mock.patch("bees.initializer.leak_detector.patch_pool")
+    @mock.patch("bees.initializer.BeesConfig")
+    def test_span_leak_threshold_implies_eventlet_scope_manager(self, config, patch_pool):
+        init_from_conf(service='test-leaks', eventlet=True, span_leak_threshold=30)
+        scope_manager = config.call_args[1]['scope_manager']
+        self.assertIsInstance(scope_manager, LeakDetectingScopeManager)
+        self.assertEqual(scope_manager.threshold, 30)
+        patch_pool.assert_called_once_with()
+
+    def test_span_leak_threshold_requires_eventlet(self):
+        self.assertRaises(ValueError, init_from_conf, service='test-leaks', span_leak_threshold=30)
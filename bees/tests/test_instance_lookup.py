@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, mock
+
+import webob
+from opentracing.mocktracer import MockTracer
+
+from bees.patch import instance_lookup
+
+
+class _Handler(object):
+
+    def __init__(self):
+        self.lookups = []
+
+    def _get_instance_and_tenant_id(self, req, skip_cache=False):
+        self.lookups.append(skip_cache)
+        return 'vm-1', 'tenant-1'
+
+
+def _request(remote_address='10.0.0.5'):
+    return webob.Request.blank('/latest/meta-data/', headers={
+        'X-Forwarded-For': remote_address,
+        'X-Neutron-Network-ID': 'net-1',
+    })
+
+
+class TestInstanceLookup(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(instance_lookup.reset_statistics)
+        self.addCleanup(instance_lookup.set_cache, None)
+        self.handler = _Handler()
+
+    def _lookup(self, req, skip_cache=False):
+        return instance_lookup.lookup(_Handler._get_instance_and_tenant_id, self.handler, req, skip_cache)
+
+    def test_without_cache(self):
+        self.assertEqual(self._lookup(_request()), ('vm-1', 'tenant-1'))
+        self.assertEqual(self._lookup(_request()), ('vm-1', 'tenant-1'))
+
+        self.assertEqual(self.handler.lookups, [False, False])
+        span = self.tracer.finished_spans()[0]
+        self.assertEqual(span.operation_name, 'get_instance_and_tenant_id')
+        self.assertEqual(span.tags['metadata.lookup'], 'miss')
+        self.assertEqual(span.tags['metadata.network_id'], 'net-1')
+        self.assertEqual(span.tags['metadata.instance_id'], 'vm-1')
+        self.assertEqual(instance_lookup.dump_statistics()['miss']['latency']['count'], 2)
+
+    def test_cache(self):
+        instance_lookup.set_cache(ttl=30)
+
+        with self.tracer.start_active_span('MetadataProxyHandler') as scope:
+            self._lookup(_request())
+            self._lookup(_request())
+            self.assertEqual(scope.span.tags['metadata.lookup'], 'hit')
+        self._lookup(_request('10.0.0.6'))
+        self._lookup(_request(), skip_cache=True)
+        self._lookup(_request())
+
+        self.assertEqual(self.handler.lookups, [False, False, True])
+        statistics = instance_lookup.dump_statistics()
+        self.assertEqual(dict((outcome, entry['latency']['count']) for outcome, entry in statistics.items()),
+                         {'miss': 2, 'hit': 2, 'refresh': 1})
+
+    def test_cache_expiry(self):
+        instance_lookup.set_cache(ttl=30, max_entries=1)
+        with mock.patch('time.monotonic', return_value=100.0):
+            self._lookup(_request())
+            self._lookup(_request())
+        with mock.patch('time.monotonic', return_value=131.0):
+            self._lookup(_request())
+            self._lookup(_request('10.0.0.6'))
+            self._lookup(_request())
+        self.assertEqual(len(self.handler.lookups), 4)
+
+    def test_not_found_is_not_cached(self):
+        instance_lookup.set_cache(ttl=30)
+        with mock.patch.object(_Handler, '_get_instance_and_tenant_id', return_value=(None, None)) as get:
+            instance_lookup.lookup(_Handler._get_instance_and_tenant_id, self.handler, _request())
+            instance_lookup.lookup(_Handler._get_instance_and_tenant_id, self.handler, _request())
+        self.assertEqual(get.call_count, 2)
@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, mock
+
+import requests
+from keystoneauth1 import exceptions, plugin
+from keystoneauth1.session import Session
+from opentracing.mocktracer import MockTracer
+
+from bees.patch import keystoneauth1
+
+
+class _Adapter(requests.adapters.BaseAdapter):
+    """Answers requests with the queued status codes, or connection errors."""
+
+    def __init__(self, *outcomes):
+        super(_Adapter, self).__init__()
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        resp = requests.Response()
+        resp.status_code = outcome
+        resp.headers['Content-Type'] = 'application/json'
+        resp._content = b'{"servers": []}'
+        resp.request = request
+        resp.url = request.url
+        return resp
+
+    def close(self):
+        pass
+
+
+class _Auth(plugin.BaseAuthPlugin):
+
+    def __init__(self):
+        super(_Auth, self).__init__()
+        self.invalidated = 0
+
+    def get_headers(self, session, **kwargs):
+        return {'X-Auth-Token': 'token-%d' % self.invalidated}
+
+    def invalidate(self):
+        self.invalidated += 1
+        return True
+
+
+class TestSessionRequest(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        keystoneauth1.bees_keystoneauth1_patch()
+        self.addCleanup(keystoneauth1.bees_keystoneauth1_unpatch)
+        keystoneauth1.set_root_spans(True)
+        self.addCleanup(keystoneauth1.set_root_spans, False)
+
+    def tearDown(self) -> None:
+        keystoneauth1.reset_statistics()
+
+    def _session(self, *outcomes):
+        adapter = _Adapter(*outcomes)
+        http = requests.Session()
+        http.mount('http://', adapter)
+        return Session(auth=_Auth(), session=http), adapter
+
+    def test_client_span(self):
+        session, adapter = self._session(200)
+        with self.tracer.start_active_span("boot"):
+            session.get("http://nova/v2.1/servers", endpoint_filter={"service_type": "compute"})
+
+        span, parent = self.tracer.finished_spans()
+        self.assertEqual(span.parent_id, parent.context.span_id)
+        self.assertEqual(span.tags["http.status_code"], 200)
+        self.assertEqual(span.tags["http.service_type"], "compute")
+        self.assertEqual(span.tags["http.response_bytes"], 15)
+        self.assertEqual(span.tags["http.attempts"], 1)
+        self.assertIn("http.elapsed", span.tags)
+        self.assertNotIn("http.retries", span.tags)
+        self.assertEqual(adapter.requests[0].headers["ot-tracer-spanid"], "%x" % span.context.span_id)
+
+        entry, = keystoneauth1.dump_statistics()
+        self.assertEqual((entry["service_type"], entry["method"]), ("compute", "GET"))
+        self.assertEqual(entry["requests"], 1)
+        self.assertEqual(entry["latency"]["count"], 1)
+        self.assertEqual(entry["auth_time"]["count"], 1)
+
+    def test_retries(self):
+        session, _ = self._session(requests.exceptions.ConnectionError(), 503, 200)
+        session.get("http://nova/v2.1/servers", endpoint_filter={"service_type": "compute"},
+                    connect_retries=1, connect_retry_delay=0,
+                    status_code_retries=1, retriable_status_codes=[503], status_code_retry_delay=0)
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["http.attempts"], 3)
+        self.assertEqual(span.tags["http.retries"], 2)
+        self.assertEqual(keystoneauth1.dump_statistics()[0]["retries"], 2)
+
+    def test_reauth(self):
+        session, adapter = self._session(401, 200)
+        session.get("http://nova/v2.1/servers", endpoint_filter={"service_type": "compute"})
+
+        span, = self.tracer.finished_spans()
+        self.assertTrue(span.tags["http.reauth"])
+        self.assertEqual(span.tags["http.attempts"], 2)
+        self.assertNotIn("http.retries", span.tags)
+        self.assertGreater(span.tags["http.auth_time"], 0)
+        self.assertEqual(adapter.requests[1].headers["X-Auth-Token"], "token-1")
+        self.assertEqual(keystoneauth1.dump_statistics()[0]["reauths"], 1)
+
+    def test_error_status(self):
+        session, _ = self._session(404)
+        self.assertRaises(exceptions.NotFound, session.get, "http://nova/v2.1/servers/x",
+                          endpoint_filter={"service_type": "compute"})
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["http.status_code"], 404)
+        self.assertTrue(span.tags["error"])
+        self.assertEqual(keystoneauth1.dump_statistics()[0]["errors"], 1)
+
+    def test_positional_arguments(self):
+        session, adapter = self._session(200)
+        caller_headers = {"Accept": "application/json"}
+        # json, original_ip, user_agent, redirect, authenticated, endpoint_filter
+        session.request("http://nova/v2.1/servers", "GET", None, None, None, None, None,
+                        {"service_type": "compute"}, headers=caller_headers)
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["http.service_type"], "compute")
+        self.assertEqual(caller_headers, {"Accept": "application/json"})
+        self.assertIn("ot-tracer-spanid", adapter.requests[0].headers)
+
+    def test_no_root_spans(self):
+        keystoneauth1.set_root_spans(False)
+        session, adapter = self._session(200)
+        session.get("http://keystone/v3/auth/tokens")
+
+        self.assertEqual(self.tracer.finished_spans(), [])
+        self.assertNotIn("ot-tracer-spanid", adapter.requests[0].headers)
+        self.assertEqual(keystoneauth1.dump_statistics(), [])
+
+    def test_unpatch(self):
+        keystoneauth1.bees_keystoneauth1_unpatch()
+        session, _ = self._session(200)
+        session.get("http://nova/v2.1/servers")
+        self.assertEqual(self.tracer.finished_spans(), [])
@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, mock
+
+import eventlet
+from eventlet import greenpool
+from opentracing.mocktracer import MockTracer
+
+from bees.eventlet import greenthreads, leak_detector
+
+
+class TestLeakDetector(TestCase):
+
+    def setUp(self):
+        self.manager = leak_detector.LeakDetectingScopeManager(threshold=30, stack_sample_rate=1.0,
+                                                                check_interval=None)
+        self.tracer = MockTracer(scope_manager=self.manager)
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.manager.reset_greenthread)
+
+    def test_closed_scopes_are_forgotten(self):
+        with self.tracer.start_active_span("sync_routers"):
+            self.assertEqual(len(self.manager.open_scopes()), 1)
+        self.assertEqual(self.manager.open_scopes(), [])
+
+    def test_report_old_scopes(self):
+        with mock.patch("time.monotonic", return_value=100.0):
+            self.tracer.start_active_span("leaked")
+        with mock.patch("time.monotonic", return_value=120.0):
+            self.assertEqual(self.manager.check(), 0)
+        with mock.patch("time.monotonic", return_value=131.0):
+            scope, = self.manager.open_scopes(threshold=30)
+            with self.assertLogs(leak_detector.logger) as logs:
+                self.assertEqual(self.manager.check(), 1)
+            self.assertEqual(self.manager.check(), 0)
+
+        self.assertEqual(scope["operation_name"], "leaked")
+        self.assertEqual(scope["age"], 31.0)
+        self.assertIn("test_report_old_scopes", scope["stack"])
+        self.assertIn("Scope open for 31.0s", logs.output[0])
+
+    def test_reset_greenthread(self):
+        parent = self.tracer.start_active_span("request")
+        self.tracer.start_active_span("leaked_1")
+        self.tracer.start_active_span("leaked_2")
+
+        with self.assertLogs(leak_detector.logger):
+            self.assertEqual(self.manager.reset_greenthread(), 3)
+        self.assertIsNone(self.manager.active)
+        self.assertEqual(self.manager.open_scopes(), [])
+        parent.close()
+
+    def test_pool_reset_keeps_inherited_scope(self):
+        leak_detector.patch_pool()
+        self.addCleanup(leak_detector.unpatch_pool)
+        greenthreads.patch_spawn()
+        self.addCleanup(greenthreads.unpatch_spawn)
+        pool = greenpool.GreenPool(2)
+
+        def leak():
+            self.tracer.start_active_span("leaked")
+
+        def clean():
+            with self.tracer.start_active_span("clean"):
+                eventlet.sleep(0)
+
+        with self.tracer.start_active_span("sync_routers") as scope:
+            with self.assertLogs(leak_detector.logger) as logs:
+                pool.spawn_n(leak)
+                pool.spawn(leak)
+                pool.spawn_n(clean)
+                pool.waitall()
+            self.assertIs(self.manager.active, scope)
+            self.assertEqual(len(logs.output), 2)
+            self.assertEqual([entry["operation_name"] for entry in self.manager.open_scopes()], ["sync_routers"])
+        self.assertEqual(self.manager.open_scopes(), [])
@@ -0,0 +1,306 @@
+from __future__ import absolute_import
+
+import logging
+import time
+from unittest import TestCase, mock
+
+from opentracing.mocktracer import MockTracer
+from opentracing.propagation import Format
+from oslo_messaging import Target
+from oslo_messaging.exceptions import MessagingTimeout
+
+from bees.patch import oslo_rpc
+
+
+class _Rendered(object):
+    """Argument that counts how often it is rendered to a string."""
+
+    def __init__(self):
+        self.rendered = 0
+
+    def __repr__(self):
+        self.rendered += 1
+        return 'rendered'
+
+    __str__ = __repr__
+
+
+class TestRpcClient(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.call_context = mock.MagicMock()
+        self.call_context.target = Target(topic="q-l3-plugin", server="network-1", version="1.5")
+        self.ctxt = mock.MagicMock()
+        self.ctxt.request_id = "req-1"
+
+    def tearDown(self) -> None:
+        oslo_rpc.reset_statistics()
+
+    def _patch(self):
+        # resolves the arguments the wrappers read from the real signatures
+        oslo_rpc.bees_rpc_patch()
+        self.addCleanup(oslo_rpc.bees_rpc_unpatch)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_call_no_formatting(self, mock_call):
+        mock_call.return_value = "result"
+        arg = _Rendered()
+
+        with mock.patch.object(oslo_rpc.logger, "isEnabledFor", return_value=False):
+            self.assertEqual(oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync", port=arg), "result")
+        self.assertEqual(arg.rendered, 0)
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["rpc.method"], "sync")
+        self.assertEqual(self.ctxt.carrier["ot-tracer-spanid"], "%x" % span.context.span_id)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_call_disabled(self, mock_call):
+        mock_call.return_value = "result"
+        oslo_rpc.disable()
+        self.addCleanup(oslo_rpc.enable)
+
+        self.assertEqual(oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync", port=1), "result")
+        mock_call.assert_called_once_with(self.call_context, self.ctxt, "sync", port=1)
+        self.assertEqual(self.tracer.finished_spans(), [])
+        self.assertEqual(oslo_rpc.in_flight(), 0)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_debug_logging(self, mock_cast):
+        arg = _Rendered()
+
+        with self.assertLogs(oslo_rpc.logger, logging.DEBUG) as logs:
+            oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update", port=arg)
+        self.assertIn("RPC CAST method: port_update, kwargs: {'port': rendered}", logs.output[0])
+        mock_cast.assert_called_once_with(self.call_context, self.ctxt, "port_update", port=arg)
+
+    @mock.patch("bees.patch.oslo_rpc._serialize_msg")
+    @mock.patch("bees.patch.oslo_rpc._Transport_send")
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_call_payload_measurements(self, mock_call, mock_send, mock_serialize):
+        self._patch()
+        mock_serialize.return_value = {"oslo.version": "2.0", "oslo.message": "x" * 120}
+
+        def send(call_context, ctxt, method, **kwargs):
+            oslo_rpc.serialize_msg_wrapper({"method": method})
+            return oslo_rpc.transport_send_wrapper("transport", "target", {}, {})
+
+        mock_call.side_effect = send
+        oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync")
+        mock_send.assert_called_once_with("transport", "target", {}, {})
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["rpc.payload_bytes"], 120)
+        self.assertIn("rpc.serialize_time", span.tags)
+        self.assertIn("rpc.send_time", span.tags)
+
+        statistics = oslo_rpc.dump_statistics()["sync"]
+        self.assertEqual(statistics["payload_bytes"]["sum"], 120)
+        self.assertEqual(statistics["send_time"]["count"], 1)
+
+        # measurements outside of an RPC are not aggregated
+        oslo_rpc.serialize_msg_wrapper({})
+        self.assertEqual(oslo_rpc.dump_statistics()["sync"]["payload_bytes"]["count"], 1)
+
+    @mock.patch("bees.patch.oslo_rpc._Transport_send")
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_call_time_includes_reply(self, mock_call, mock_send):
+        self._patch()
+
+        def send(call_context, ctxt, method, **kwargs):
+            return oslo_rpc.transport_send_wrapper("transport", "target", {}, {}, wait_for_reply=True)
+
+        mock_call.side_effect = send
+        oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync")
+
+        span, = self.tracer.finished_spans()
+        self.assertIn("rpc.call_time", span.tags)
+        self.assertNotIn("rpc.send_time", span.tags)
+        statistics = oslo_rpc.dump_statistics()["sync"]
+        self.assertEqual(statistics["call_time"]["count"], 1)
+        self.assertNotIn("send_time", statistics)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_call_timeout(self, mock_call):
+        def timeout(call_context, ctxt, method, **kwargs):
+            self.assertEqual(oslo_rpc.in_flight(), 1)
+            # nested work is parented to the client span
+            with self.tracer.start_active_span("nested"):
+                pass
+            raise MessagingTimeout("timed out")
+
+        mock_call.side_effect = timeout
+        self.assertRaises(MessagingTimeout, oslo_rpc.call_wrapper, self.call_context, self.ctxt, "sync")
+        mock_call.side_effect = None
+        oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync")
+
+        nested, timed_out, ok = self.tracer.finished_spans()
+        self.assertEqual(nested.parent_id, timed_out.context.span_id)
+        self.assertTrue(timed_out.tags["error"])
+        self.assertTrue(timed_out.tags["rpc.timeout"])
+        self.assertNotIn("error", ok.tags)
+
+        self.assertEqual(oslo_rpc.in_flight(), 0)
+        self.assertIsNone(self.tracer.active_span)
+        self.assertEqual(oslo_rpc.timeout_rates(), {"sync": 0.5})
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_error(self, mock_cast):
+        mock_cast.side_effect = ValueError("boom")
+        self.assertRaises(ValueError, oslo_rpc.cast_wrapper, self.call_context, self.ctxt, "port_update")
+
+        span, = self.tracer.finished_spans()
+        self.assertTrue(span.tags["error"])
+        self.assertEqual(oslo_rpc.dump_statistics()["port_update"]["errors"], 1)
+        self.assertEqual(oslo_rpc.in_flight(), 0)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_call")
+    def test_target_statistics(self, mock_call, mock_cast):
+        oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync_routers")
+        oslo_rpc.call_wrapper(self.call_context, self.ctxt, "sync_routers")
+        self.call_context.target = Target(topic="dhcp_agent", fanout=True)
+        oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update_end")
+
+        span = self.tracer.finished_spans()[0]
+        self.assertEqual(span.tags["rpc.topic"], "q-l3-plugin")
+        self.assertEqual(span.tags["rpc.server"], "network-1")
+        self.assertEqual(span.tags["rpc.version"], "1.5")
+        self.assertTrue(self.tracer.finished_spans()[2].tags["rpc.fanout"])
+
+        statistics = sorted(oslo_rpc.dump_target_statistics(), key=lambda entry: entry["topic"])
+        self.assertEqual([(entry["topic"], entry["server"], entry["method"], entry["kind"], entry["latency"]["count"])
+                          for entry in statistics],
+                         [("dhcp_agent", None, "port_update_end", "cast", 1),
+                          ("q-l3-plugin", "network-1", "sync_routers", "call", 2)])
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_coalescing(self, mock_cast):
+        oslo_rpc.set_cast_coalescing(60)
+        self.addCleanup(oslo_rpc.set_cast_coalescing, None)
+        self.call_context.target = Target(topic="q-agent-notifier-port-update", fanout=True)
+        carriers = []
+        mock_cast.side_effect = lambda call_context, ctxt, method, **kwargs: carriers.append(ctxt.carrier)
+
+        with self.tracer.start_active_span("update_ports"):
+            for _ in range(5):
+                oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+            oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_delete")
+            self.assertEqual(len(self.tracer.finished_spans()), 0)
+            oslo_rpc.flush_coalesced_casts()
+
+        update, delete, parent = self.tracer.finished_spans()
+        self.assertEqual(update.tags["rpc.cast_count"], 5)
+        self.assertTrue(update.tags["rpc.coalesced"])
+        self.assertEqual(update.parent_id, parent.context.span_id)
+        self.assertEqual(delete.tags["rpc.cast_count"], 1)
+        self.assertEqual(len(set(carrier["ot-tracer-spanid"] for carrier in carriers[:5])), 1)
+        self.assertIsNot(carriers[0], carriers[1])
+        self.assertEqual(oslo_rpc.dump_statistics()["port_update"]["sent"], 5)
+        self.assertEqual(oslo_rpc.in_flight(), 0)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_coalescing_window(self, mock_cast):
+        oslo_rpc.set_cast_coalescing(0.5)
+        self.addCleanup(oslo_rpc.set_cast_coalescing, None)
+
+        with self.tracer.start_active_span("update_ports"):
+            with mock.patch("time.monotonic", return_value=100.0):
+                oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+                oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+            with mock.patch("time.monotonic", return_value=101.0):
+                oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+
+            span, = self.tracer.finished_spans()
+            self.assertEqual(span.tags["rpc.cast_count"], 2)
+        oslo_rpc.set_cast_coalescing(None)
+        self.assertEqual([span.tags["rpc.cast_count"] for span in self.tracer.finished_spans()
+                          if "rpc.coalesced" in span.tags], [2, 1])
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_coalescing_flushed_when_idle(self, mock_cast):
+        oslo_rpc.set_cast_coalescing(0.05)
+        self.addCleanup(oslo_rpc.set_cast_coalescing, None)
+
+        with self.tracer.start_active_span("update_ports"):
+            oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+        deadline = time.monotonic() + 5
+        while len(self.tracer.finished_spans()) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(span.operation_name for span in self.tracer.finished_spans()),
+                         ["RPC_CAST", "update_ports"])
+        flusher = oslo_rpc._FLUSHER
+        if flusher is not None:
+            flusher.join(5)
+        # the flusher exits once no group is open
+        self.assertIsNone(oslo_rpc._FLUSHER)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_coalescing_flushed_on_disable(self, mock_cast):
+        oslo_rpc.set_cast_coalescing(60)
+        self.addCleanup(oslo_rpc.set_cast_coalescing, None)
+        self.addCleanup(oslo_rpc.enable)
+
+        with self.tracer.start_active_span("update_ports"):
+            oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+            oslo_rpc.disable()
+            span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["rpc.cast_count"], 1)
+
+    @mock.patch("bees.patch.oslo_rpc._BaseCallContext_cast")
+    def test_cast_coalescing_without_parent(self, mock_cast):
+        oslo_rpc.set_cast_coalescing(60)
+        self.addCleanup(oslo_rpc.set_cast_coalescing, None)
+
+        oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+        oslo_rpc.cast_wrapper(self.call_context, self.ctxt, "port_update")
+        self.assertEqual(len(self.tracer.finished_spans()), 2)
+
+
+class TestRpcDispatcher(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        oslo_rpc.reset_statistics()
+
+    def _incoming(self, sent_at):
+        parent = self.tracer.start_span("RPC_CAST")
+        carrier = {}
+        self.tracer.inject(parent.context, Format.TEXT_MAP, carrier)
+        carrier[oslo_rpc.SENT_AT] = repr(sent_at)
+
+        incoming = mock.MagicMock()
+        incoming.msg_id = None
+        incoming.message = {"method": "port_update", "args": {}}
+        incoming.ctxt = {"request_id": "req-1", "carrier": carrier}
+        return parent, incoming
+
+    @mock.patch("bees.patch.oslo_rpc._RPCDispatcher_dispatch")
+    def test_queue_wait(self, mock_dispatch):
+        parent, incoming = self._incoming(time.time() - 2)
+        oslo_rpc.dispatch_wrapper("dispatcher", incoming)
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.parent_id, parent.context.span_id)
+        self.assertGreaterEqual(span.tags["rpc.queue_wait"], 2)
+        self.assertEqual(oslo_rpc.dump_statistics()["port_update"]["queue_wait"]["count"], 1)
+
+    @mock.patch("bees.patch.oslo_rpc._RPCDispatcher_dispatch")
+    def test_queue_wait_clock_skew(self, mock_dispatch):
+        parent, incoming = self._incoming(time.time() + 60)
+        oslo_rpc.dispatch_wrapper("dispatcher", incoming)
+
+        span, = self.tracer.finished_spans()
+        self.assertNotIn("rpc.queue_wait", span.tags)
+        self.assertLess(span.tags["rpc.queue_wait_skewed"], 0)
+        self.assertEqual(oslo_rpc.dump_statistics(), {})
@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 from unittest import TestCase, mock
 
-from bees import profiler
+from bees import profiler, utils
 
 
 @profiler.trace('add')
@@ -234,3 +234,100 @@ class TestClsDecorator(TestCase):
     def test_class_skip(self, mock_tracer):
         self.assertEqual(FakeTraceClassSkip.class_method(10), 10)
         mock_tracer.start_active_span.assert_not_called()
+
+
+class TestGetClassFunctions(TestCase):
+
+    def test_single_pass(self):
+        class Base(object):
+            def shadowed(self):
+                pass
+
+            def inherited(self):
+                pass
+
+            @classmethod
+            def class_method(cls):
+                pass
+
+        class Child(Base):
+            shadowed = None
+
+            @property
+            def prop(self):
+                raise AssertionError("descriptors must not be invoked")
+
+            @staticmethod
+            def static_method():
+                pass
+
+        functions = dict((name, (function, wrapper)) for name, function, wrapper
+                         in utils.get_class_functions(Child))
+        self.assertNotIn("shadowed", functions)
+        self.assertNotIn("prop", functions)
+        self.assertEqual(functions["inherited"], (Base.__dict__["inherited"], None))
+        self.assertEqual(functions["static_method"], (Child.__dict__["static_method"].__func__, staticmethod))
+        self.assertEqual(functions["class_method"], (Base.__dict__["class_method"].__func__, classmethod))
+        self.assertEqual(utils.get_class_functions(Child()), utils.get_class_functions(Child))
+
+    @mock.patch("opentracing.tracer")
+    def test_class_method_gets_class_once(self, mock_tracer):
+        calls = []
+
+        class Base(object):
+            @classmethod
+            def class_method(cls, *args):
+                calls.append((cls, args))
+
+        @profiler.trace_cls('rpc', trace_class_methods=True)
+        class Child(Base):
+            pass
+
+        Child.class_method(1)
+        self.assertEqual(calls, [(Child, (1,))])
+
+
+class TestLazyTrace(TestCase):
+
+    @mock.patch("opentracing.tracer")
+    def test_trace_cls(self, mock_tracer):
+        @profiler.trace_cls('rpc', trace_class_methods=True, lazy=True)
+        class Lazy(FakeTraceClassBase):
+            pass
+
+        self.assertIsInstance(vars(Lazy)["method1"], utils.LazyTraced)
+        self.assertIsInstance(vars(Lazy)["class_method"], utils.LazyTraced)
+        mock_tracer.start_active_span.assert_not_called()
+
+        self.assertEqual(Lazy().method1(5, 15), 30)
+        self.assertEqual(Lazy.class_method(3), 3)
+        self.assertEqual(mock_tracer.start_active_span.call_count, 2)
+
+        # installed on first access, the others are left alone
+        self.assertNotIsInstance(vars(Lazy)["method1"], utils.LazyTraced)
+        self.assertIsInstance(vars(Lazy)["class_method"], classmethod)
+        self.assertIsInstance(vars(Lazy)["method2"], utils.LazyTraced)
+        self.assertEqual(Lazy().method1(5, 15), 30)
+        self.assertEqual(mock_tracer.start_active_span.call_count, 3)
+
+    @mock.patch("opentracing.tracer")
+    def test_traced_meta(self, mock_tracer):
+        class Lazy(object, metaclass=profiler.TracedMeta):
+            __trace_args__ = {'name': 'rpc', 'lazy': True}
+
+            def method(self, a):
+                return a
+
+        self.assertIsInstance(vars(Lazy)["method"], utils.LazyTraced)
+        self.assertEqual(Lazy().method(1), 1)
+        mock_tracer.start_active_span.assert_called_once_with(operation_name='rpc')
+        self.assertNotIsInstance(vars(Lazy)["method"], utils.LazyTraced)
+
+    def test_rescan_installs(self):
+        @profiler.trace_cls('rpc', lazy=True)
+        class Lazy(FakeTracedCls):
+            pass
+
+        functions = dict((name, function) for name, function, _ in utils.get_class_functions(Lazy))
+        self.assertIs(functions["method1"], vars(Lazy)["method1"])
+        self.assertIsNot(functions["method1"], FakeTracedCls.method1)
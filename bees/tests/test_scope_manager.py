@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, mock
+
+import eventlet
+
+from bees.eventlet.scope_manager import EventletScopeManager
+
+
+class TestEventletScopeManager(TestCase):
+
+    def test_activate_close(self):
+        manager = EventletScopeManager()
+        span = mock.MagicMock()
+
+        scope = manager.activate(span, finish_on_close=True)
+        self.assertIs(manager.active, scope)
+        self.assertIs(scope.span, span)
+        self.assertFalse(hasattr(scope, "__dict__"))
+
+        scope.close()
+        self.assertIsNone(manager.active)
+        span.finish.assert_called_once()
+
+    def test_nested_restore(self):
+        manager = EventletScopeManager()
+        parent = manager.activate(mock.MagicMock(), finish_on_close=False)
+        child = manager.activate(mock.MagicMock(), finish_on_close=False)
+
+        # closing a scope that is not active is a no-op
+        parent.close()
+        self.assertIs(manager.active, child)
+
+        child.close()
+        self.assertIs(manager.active, parent)
+        parent.close()
+        self.assertIsNone(manager.active)
+
+    def test_error_tagged_on_exit(self):
+        manager = EventletScopeManager()
+        span = mock.MagicMock()
+        with self.assertRaises(ValueError):
+            with manager.activate(span, finish_on_close=True):
+                raise ValueError()
+        span.set_tag.assert_any_call('error', True)
+        span.finish.assert_called_once()
+
+    def test_greenthreads_are_isolated(self):
+        manager = EventletScopeManager()
+
+        def child():
+            self.assertIsNone(manager.active)
+            with manager.activate(mock.MagicMock(), finish_on_close=False) as scope:
+                eventlet.sleep(0)
+                self.assertIs(manager.active, scope)
+            return manager.active
+
+        with manager.activate(mock.MagicMock(), finish_on_close=False) as scope:
+            threads = [eventlet.spawn(child) for _ in range(3)]
+            self.assertEqual([thread.wait() for thread in threads], [None] * 3)
+            self.assertIs(manager.active, scope)
+
+    def test_explicit_greenthread(self):
+        manager = EventletScopeManager()
+        thread = eventlet.spawn(eventlet.sleep, 0)
+        scope = mock.MagicMock()
+        manager._set_scope(scope, thread)
+        self.assertIs(manager._get_scope(thread), scope)
+        self.assertIsNone(manager._get_scope())
+        thread.wait()
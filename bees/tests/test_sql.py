@@ -1,60 +1,132 @@
 from __future__ import absolute_import
 
 import contextlib
+import gc
+import time
 from unittest import TestCase, mock
 
+import eventlet
+import sqlalchemy
+from opentracing.mocktracer import MockTracer
+from sqlalchemy.orm import Session
+
 from bees import sql
+from bees.eventlet.scope_manager import EventletScopeManager
 
 
 class TestSql(TestCase):
 
-    @mock.patch("bees_profiler.sql._before_cursor_execute")
-    @mock.patch("bees_profiler.sql._after_cursor_execute")
+    def tearDown(self) -> None:
+        sql._ENGINES.clear()
+        sql.reset_statistics()
+        sql.set_result_preview(rows=0)
+
+    @mock.patch("bees.sql._before_cursor_execute")
+    @mock.patch("bees.sql._after_cursor_execute")
     def test_disabled(self, mock_after_exc, mock_before_exc):
         sqlalchemy = mock.MagicMock()
         engine = mock.MagicMock()
 
+        # listeners are installed anyway, they check the flag on every query
         sql.disable()
-        sql.add_tracing(sqlalchemy, engine)
-        self.assertFalse(mock_after_exc.called)
-        self.assertFalse(mock_before_exc.called)
-
-        sql.enable()
+        self.addCleanup(sql.enable)
         sql.add_tracing(sqlalchemy, engine)
         self.assertTrue(mock_after_exc.called)
         self.assertTrue(mock_before_exc.called)
 
-    def test_before_execute(self):
+    @mock.patch("opentracing.tracer")
+    def test_before_execute(self, mock_tracer):
         handler = sql._before_cursor_execute()
         conn = mock.MagicMock()
         context = mock.MagicMock()
         context.compiled.statement.__visit_name__ = "test"
-        handler(conn, "cursor", "statement", "params", context, "executemany")
+        handler(conn, "cursor", "SELECT * FROM ports WHERE id = %(id_1)s", {"id_1": "x"}, context, False)
         self.assertTrue(context._span)
+        context._span.set_tag.assert_any_call("db.fingerprint", sql.fingerprint("SELECT * FROM ports WHERE id = ?")[0])
+        self.assertNotIn("db.statement", [call.args[0] for call in context._span.set_tag.call_args_list])
 
     def test_after_execute(self):
         handler = sql._after_cursor_execute()
         cursor = mock.MagicMock()
+        cursor.rowcount = 3
         context = mock.MagicMock()
         context._span = mock.MagicMock()
-        handler("conn", cursor, "statement", "params", context, "executemany")
+        context._start_time = time.monotonic()
+        handler("conn", cursor, "SELECT 1", "params", context, False)
         context._span.finish.assert_called_once()
 
+        expected_calls = [
+            mock.call("db.rowcount", 3),
+            mock.call("db.columns", len(cursor.description)),
+        ]
+        self.assertEqual(context._span.set_tag.call_args_list, expected_calls)
+
+        fingerprint_id, normalized = sql.fingerprint("SELECT 1")
+        statistics = sql.dump_statistics()[fingerprint_id]
+        self.assertEqual(statistics["statement"], normalized)
+        self.assertEqual(statistics["latency"]["count"], 1)
+        self.assertEqual(statistics["rows"]["sum"], 3)
+
+    def test_after_execute_preview(self):
+        handler = sql._after_cursor_execute()
+        cursor = mock.MagicMock()
+        cursor.rowcount = 1000
+        cursor.description = [("id",), ("name",)]
+        cursor._rows = [(i, "port-%d" % i) for i in range(1000)]
+        context = mock.MagicMock()
+        context._start_time = time.monotonic()
+
+        sql.set_result_preview(rows=2)
+        handler("conn", cursor, "SELECT 1", "params", context, False)
+        context._span.set_tag.assert_any_call("db.result", "[(0, 'port-0'), (1, 'port-1')]")
+
+        sql.set_result_preview(rows=100, max_bytes=40)
+        handler("conn", cursor, "SELECT 1", "params", context, False)
+        context._span.set_tag.assert_any_call("db.result", "[(0, 'port-0'), (1, 'port-1'), ...]")
+
+    def test_preview_limits_encoded_bytes(self):
+        rows = [(i, "port-\u00e9\u00e9\u00e9") for i in range(10)]
+        preview = sql._render_rows(rows, 10, 60)
+        self.assertLessEqual(len(preview.encode("utf-8")), 60)
+        self.assertEqual(preview, "[(0, 'port-\u00e9\u00e9\u00e9'), (1, 'port-\u00e9\u00e9\u00e9'), ...]")
+
+    def test_preview_needs_buffered_rows(self):
+        cursor = mock.MagicMock(spec=["rowcount", "description", "fetchone"])
+        sql.set_result_preview(rows=2)
+        self.assertIsNone(sql._result_preview(cursor))
+
+    def test_fingerprint(self):
+        fingerprint_id, normalized = sql.fingerprint(
+            "SELECT ports.id FROM ports WHERE ports.id IN (%(id_1)s, %(id_2)s) "
+            "AND ports.name = 'a''b' LIMIT 10")
+        self.assertEqual(normalized, "SELECT ports.id FROM ports WHERE ports.id IN (?+) AND ports.name = ? LIMIT ?")
+        self.assertEqual(fingerprint_id, sql.fingerprint(
+            "SELECT ports.id FROM ports WHERE ports.id IN (1, 2, 3) AND ports.name = 'c' LIMIT 1")[0])
+
+        self.assertEqual(sql.fingerprint("INSERT INTO t1 (a, b) VALUES (1, 'x'), (2, 'y')")[1],
+                         "INSERT INTO t1 (a, b) VALUES (?, ?), ...")
+        self.assertEqual(sql.fingerprint("SELECT a FROM t WHERE b IN (__[POSTCOMPILE_b_1])")[1],
+                         "SELECT a FROM t WHERE b IN (?+)")
+
     def test_error_handle(self):
         original_exception = Exception("error")
         chained_exception = Exception("error and the reason")
 
         sqlalchemy_exception_ctx = mock.MagicMock()
-        sqlalchemy_exception_ctx._span = mock.MagicMock()
+        sqlalchemy_exception_ctx.statement = "SELECT 1"
+        sqlalchemy_exception_ctx.execution_context._span = mock.MagicMock()
+        sqlalchemy_exception_ctx.execution_context._start_time = time.monotonic()
+        sqlalchemy_exception_ctx.execution_context.executemany = False
         sqlalchemy_exception_ctx.original_exception = original_exception
         sqlalchemy_exception_ctx.chained_exception = chained_exception
 
         sql._handle_error(sqlalchemy_exception_ctx)
-        sqlalchemy_exception_ctx._span.finish.assert_called_once()
+        sqlalchemy_exception_ctx.execution_context._span.finish.assert_called_once()
+        self.assertEqual(sql.dump_statistics()[sql.fingerprint("SELECT 1")[0]]["errors"], 1)
 
-    @mock.patch("bees_profiler.sql._before_cursor_execute")
-    @mock.patch("bees_profiler.sql._after_cursor_execute")
-    @mock.patch("bees_profiler.sql._handle_error")
+    @mock.patch("bees.sql._before_cursor_execute")
+    @mock.patch("bees.sql._after_cursor_execute")
+    @mock.patch("bees.sql._handle_error")
     def test_add_tracing(self, mock_handle_error, mock_after_execute, mock_before_execute):
         sqlalchemy = mock.MagicMock()
         engine = mock.MagicMock()
@@ -74,9 +146,51 @@ class TestSql(TestCase):
 
         self.assertEqual(sqlalchemy.event.listen.call_args_list, expected_calls)
 
-    @mock.patch("bees_profiler.sql._before_cursor_execute")
-    @mock.patch("bees_profiler.sql._after_cursor_execute")
-    @mock.patch("bees_profiler.sql._handle_error")
+    @mock.patch("bees.sql._before_cursor_execute")
+    @mock.patch("bees.sql._after_cursor_execute")
+    @mock.patch("bees.sql._handle_error")
+    def test_add_tracing_idempotent(self, mock_handle_error, mock_after_execute, mock_before_execute):
+        sqlalchemy = mock.MagicMock()
+        engine = mock.MagicMock()
+
+        for _ in range(10):
+            sql.add_tracing(sqlalchemy, engine)
+        self.assertEqual(sqlalchemy.event.listen.call_count, 3)
+        self.assertEqual(sql.instrumented_engines(), 1)
+
+        sql.add_tracing(sqlalchemy, mock.MagicMock())
+        self.assertEqual(sqlalchemy.event.listen.call_count, 6)
+        self.assertEqual(sql.instrumented_engines(), 2)
+
+    def test_remove_tracing(self):
+        sqlalchemy = mock.MagicMock()
+        engine = mock.MagicMock()
+
+        sql.add_tracing(sqlalchemy, engine)
+        sql.remove_tracing(sqlalchemy, engine)
+        sql.remove_tracing(sqlalchemy, engine)
+        self.assertEqual(sql.instrumented_engines(), 0)
+
+        listened = [c.args for c in sqlalchemy.event.listen.call_args_list]
+        removed = [c.args for c in sqlalchemy.event.remove.call_args_list]
+        self.assertEqual(listened, removed)
+
+        # the engine can be instrumented again once removed
+        sql.add_tracing(sqlalchemy, engine)
+        self.assertEqual(sqlalchemy.event.listen.call_count, 6)
+
+    def test_engine_garbage_collected(self):
+        engine = mock.MagicMock()
+        sql.add_tracing(mock.MagicMock(), engine)
+        self.assertEqual(sql.instrumented_engines(), 1)
+
+        del engine
+        gc.collect()
+        self.assertEqual(sql.instrumented_engines(), 0)
+
+    @mock.patch("bees.sql._before_cursor_execute")
+    @mock.patch("bees.sql._after_cursor_execute")
+    @mock.patch("bees.sql._handle_error")
     def test_wrap_session(self, mock_handle_error, mock_after_execute, mock_before_execute):
         sqlalchemy = mock.MagicMock()
 
@@ -106,3 +220,197 @@ class TestSql(TestCase):
         ]
 
         self.assertEqual(sqlalchemy.event.listen.call_args_list, expected_calls)
+
+
+class TestSqlEngine(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.engine = sqlalchemy.create_engine("sqlite://")
+
+    def tearDown(self) -> None:
+        sql.remove_tracing(sqlalchemy, self.engine)
+        sql.reset_statistics()
+        sql.reset_pool_statistics()
+        sql.set_slow_query_mode(None)
+        sql.set_pool_tracing(False)
+        sql.set_executemany_sample()
+
+    def _query(self):
+        with sql.wrap_session(sqlalchemy, Session(self.engine)) as sess:
+            sess.execute(sqlalchemy.text("SELECT 1")).fetchall()
+
+    def test_one_span_per_query_across_sessions(self):
+        for sessions in (1, 10, 100):
+            self.tracer.reset()
+            for _ in range(sessions):
+                self._query()
+            self.assertEqual(len(self.tracer.finished_spans()), sessions)
+
+        self.assertEqual(sql.instrumented_engines(), 1)
+        self.assertEqual(len(self.engine.dispatch.before_cursor_execute), 1)
+
+    def test_enabled_after_engine_created(self):
+        sql.disable()
+        self.addCleanup(sql.enable)
+        self._query()
+        self.assertEqual(self.tracer.finished_spans(), [])
+        self.assertEqual(sql.instrumented_engines(), 1)
+
+        sql.enable()
+        self._query()
+        self.assertEqual(len(self.tracer.finished_spans()), 1)
+
+    def test_remove_tracing(self):
+        self._query()
+        sql.remove_tracing(sqlalchemy, self.engine)
+        with self.engine.connect() as conn:
+            conn.execute(sqlalchemy.text("SELECT 1")).fetchall()
+
+        self.assertEqual(len(self.tracer.finished_spans()), 1)
+        self.assertEqual(len(self.engine.dispatch.before_cursor_execute), 0)
+
+    def test_executemany(self):
+        sql.add_tracing(sqlalchemy, self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text("CREATE TABLE ports (id INTEGER, name VARCHAR)"))
+            self.tracer.reset()
+            conn.execute(sqlalchemy.text("INSERT INTO ports (id, name) VALUES (:id, :name)"),
+                         [{"id": i, "name": "port-%d" % i} for i in range(1000)])
+
+        span, = self.tracer.finished_spans()
+        self.assertTrue(span.tags["db.executemany"])
+        self.assertEqual(span.tags["db.batch_size"], 1000)
+        self.assertEqual(span.tags["db.params_sample"], "[(0, 'port-0'), (1, 'port-1'), (2, 'port-2')]")
+        self.assertIn("db.row_latency", span.tags)
+
+        statistics = sql.dump_statistics()[span.tags["db.fingerprint"]]
+        self.assertEqual(statistics["batch_size"]["sum"], 1000)
+        self.assertEqual(statistics["batch_latency"]["count"], 1)
+        self.assertNotIn("latency", statistics)
+
+    def test_slow_query_mode(self):
+        sql.set_slow_query_mode(threshold=60)
+        for _ in range(10):
+            self._query()
+        self.assertEqual(self.tracer.finished_spans(), [])
+
+        fingerprint_id = sql.fingerprint("SELECT 1")[0]
+        self.assertEqual(sql.dump_statistics()[fingerprint_id]["latency"]["count"], 10)
+
+        sql.set_slow_query_mode(threshold=0)
+        self._query()
+        span, = self.tracer.finished_spans()
+        self.assertTrue(span.tags["db.slow_query"])
+        self.assertEqual(span.tags["db.statement"], "SELECT ?")
+        self.assertLessEqual(span.start_time, span.finish_time)
+
+    def test_slow_query_mode_sampling(self):
+        fingerprint_id = sql.fingerprint("SELECT 1")[0]
+        sql.set_slow_query_mode(threshold=60, sample_rates={fingerprint_id: 1.0})
+        self._query()
+        span, = self.tracer.finished_spans()
+        self.assertFalse(span.tags["db.slow_query"])
+
+    def test_slow_query_mode_error(self):
+        sql.set_slow_query_mode(threshold=60)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            with sql.wrap_session(sqlalchemy, Session(self.engine)) as sess:
+                sess.execute(sqlalchemy.text("SELECT * FROM missing"))
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual(span.tags["error"], "true")
+        self.assertEqual(span.tags["db.statement"], "SELECT * FROM missing")
+
+    def test_pool_tracing(self):
+        sql.set_pool_tracing()
+        engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.QueuePool)
+        self.addCleanup(sql.remove_tracing, sqlalchemy, engine)
+        sql.add_tracing(sqlalchemy, engine)
+
+        for _ in range(3):
+            with engine.begin() as conn:
+                conn.execute(sqlalchemy.text("SELECT 1")).fetchall()
+                conn.execute(sqlalchemy.text("SELECT 2")).fetchall()
+
+        spans = self.tracer.finished_spans()
+        transactions = [span for span in spans if span.operation_name == "transaction"]
+        queries = [span for span in spans if span.operation_name != "transaction"]
+        self.assertEqual(len(transactions), 3)
+        self.assertEqual(len(queries), 6)
+        transaction_ids = {span.context.span_id for span in transactions}
+        self.assertTrue(all(span.parent_id in transaction_ids for span in queries))
+        self.assertTrue(all(span.tags["db.transaction"] == "commit" for span in transactions))
+
+        statistics = sql.dump_pool_statistics()[repr(engine.url)]
+        self.assertEqual(statistics["checkout_wait"]["count"], 3)
+        self.assertEqual(statistics["checkout_hold"]["count"], 3)
+        self.assertEqual(statistics["connect"]["count"], 1)
+        self.assertEqual(statistics["transaction"]["count"], 3)
+        self.assertEqual(statistics["commit"], 3)
+
+        # a recreated pool is instrumented as well
+        engine.dispose()
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("SELECT 1"))
+            conn.rollback()
+        statistics = sql.dump_pool_statistics()[repr(engine.url)]
+        self.assertEqual(statistics["checkout_wait"]["count"], 4)
+        self.assertEqual(statistics["rollback"], 1)
+
+        sql.remove_tracing(sqlalchemy, engine)
+        self.assertNotIn("connect", engine.pool.__dict__)
+
+    def test_pool_tracing_engine_garbage_collected(self):
+        sql.set_pool_tracing()
+        engine = sqlalchemy.create_engine("sqlite://")
+        sql.add_tracing(sqlalchemy, engine)
+        self.assertEqual(sql.instrumented_engines(), 1)
+
+        del engine
+        gc.collect()
+        self.assertEqual(sql.instrumented_engines(), 0)
+
+
+class TestSqlGreenthreads(TestCase):
+
+    def setUp(self):
+        self.tracer = MockTracer(scope_manager=EventletScopeManager())
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.NullPool)
+
+    def tearDown(self) -> None:
+        sql.remove_tracing(sqlalchemy, self.engine)
+        sql.reset_statistics()
+
+    def _request(self, i):
+        with self.tracer.start_active_span("request-%d" % i) as scope:
+            eventlet.sleep(0)
+            with sql.wrap_session(sqlalchemy, Session(self.engine)) as sess:
+                sess.execute(sqlalchemy.text("SELECT %d" % i)).fetchall()
+                eventlet.sleep(0)
+                sess.execute(sqlalchemy.text("SELECT %d" % i)).fetchall()
+            return scope.span
+
+    def test_concurrent_parenting(self):
+        pool = eventlet.GreenPool(500)
+        requests = list(pool.imap(self._request, range(500)))
+        self.assertFalse(hasattr(self.engine, "_parent_span"))
+
+        by_span_id = {span.context.span_id: span for span in requests}
+        queries = [span for span in self.tracer.finished_spans() if span not in requests]
+        self.assertEqual(len(queries), 1000)
+
+        for query in queries:
+            parent = by_span_id[query.parent_id]
+            self.assertEqual(query.context.trace_id, parent.context.trace_id)
+            self.assertEqual(query.tags["db.fingerprint"], sql.fingerprint("SELECT ?")[0])
+        self.assertEqual(sorted(query.parent_id for query in queries),
+                         sorted(2 * [span.context.span_id for span in requests]))
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+from unittest import TestCase
+
+from bees import stats
+
+
+class TestHistogram(TestCase):
+
+    def test_observe(self):
+        histogram = stats.Histogram(bounds=(1, 10, 100))
+        for value in (0.5, 5, 5, 50, 500):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 560.5)
+        self.assertEqual(histogram.min, 0.5)
+        self.assertEqual(histogram.max, 500)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+
+    def test_percentile(self):
+        histogram = stats.Histogram(bounds=(1, 10, 100))
+        self.assertIsNone(histogram.percentile(50))
+
+        for value in range(1, 101):
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(5), 10)
+        self.assertEqual(histogram.percentile(50), 100)
+        self.assertEqual(histogram.percentile(100), 100)
+
+        histogram.observe(1000)
+        self.assertEqual(histogram.percentile(100), 1000)
+
+
+class TestAggregator(TestCase):
+
+    def test_dump(self):
+        aggregator = stats.Aggregator({'latency': stats.LATENCY_BUCKETS})
+        aggregator.observe('a', 'latency', 0.002)
+        aggregator.observe('a', 'latency', 0.004)
+        aggregator.incr('a', 'errors')
+        aggregator.label('a', 'statement', 'SELECT ?')
+
+        dump = aggregator.dump()
+        self.assertEqual(list(dump), ['a'])
+        self.assertEqual(dump['a']['statement'], 'SELECT ?')
+        self.assertEqual(dump['a']['errors'], 1)
+        self.assertEqual(dump['a']['latency']['count'], 2)
+        self.assertEqual(dump['a']['latency']['p50'], 0.0025)
+
+        aggregator.reset()
+        self.assertEqual(aggregator.dump(), {})
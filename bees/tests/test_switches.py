@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+import os
+import signal
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from opentracing.mocktracer import MockTracer
+
+from bees import decorate, profiler, sql, switches
+
+
+@profiler.trace('add')
+def profiled(a, b):
+    return a + b
+
+
+@decorate.trace('add')
+def decorated(a, b):
+    return a + b
+
+
+class TestSwitches(TestCase):
+
+    def setUp(self):
+        self.handlers = dict((name, list(handlers)) for name, handlers in switches._HANDLERS.items())
+        self.tracer = MockTracer()
+        patcher = mock.patch("opentracing.tracer", self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        switches.enable()
+        switches._STATE.clear()
+        switches._HANDLERS.clear()
+        switches._HANDLERS.update(self.handlers)
+
+    def test_unknown_subsystem(self):
+        self.assertRaises(ValueError, switches.disable, 'nosuch')
+        self.assertRaises(ValueError, switches.register, 'nosuch', None, None)
+
+    def test_register_applies_state(self):
+        enable, disable = mock.Mock(), mock.Mock()
+        switches.disable('rpc')
+        switches.register('rpc', enable, disable)
+        disable.assert_called_once_with()
+
+        switches.enable()
+        enable.assert_called_once_with()
+        self.assertEqual(switches.state(), dict((name, True) for name in switches.SUBSYSTEMS))
+
+    def test_function(self):
+        switches.disable('function')
+        self.assertTrue(profiler._DISABLED)
+        self.assertTrue(decorate._DISABLED)
+        self.assertEqual(profiled(1, 2), 3)
+        self.assertEqual(decorated(1, 2), 3)
+        self.assertEqual(self.tracer.finished_spans(), [])
+
+        switches.enable('function')
+        self.assertEqual(profiled(1, 2), 3)
+        self.assertEqual(decorated(1, 2), 3)
+        self.assertEqual(len(self.tracer.finished_spans()), 2)
+
+    def test_sql_listeners(self):
+        switches.disable('sql')
+        context = mock.MagicMock()
+        sql._before_cursor_execute()("conn", "cursor", "SELECT 1", {}, context, False)
+        self.assertIsNone(context._span)
+        self.assertIsNone(context._start_time)
+        sql._after_cursor_execute()("conn", mock.MagicMock(), "SELECT 1", {}, context, False)
+        self.assertEqual(self.tracer.finished_spans(), [])
+
+    def test_load(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.switches', delete=False) as f:
+            f.write("# comment\nall = off\nrpc = on  # keep RPCs\nweb\nsql = maybe\n")
+        self.addCleanup(os.unlink, f.name)
+
+        with self.assertLogs(switches.logger) as logs:
+            state = switches.load(f.name)
+        self.assertEqual(state, {'function': False, 'web': False, 'sql': False, 'rpc': True, 'http': False})
+        self.assertEqual(len([line for line in logs.output if 'Ignoring line' in line]), 2)
+
+        # a missing file leaves everything as it is
+        self.assertEqual(switches.load(f.name + '.missing'), state)
+
+    def test_signal_handler(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.switches', delete=False) as f:
+            f.write("function = on\n")
+        self.addCleanup(os.unlink, f.name)
+        previous = signal.getsignal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+
+        stop = switches.install_signal_handler(f.name, interval=0.01)
+        self.addCleanup(stop.set)
+        self.assertFalse(profiler._DISABLED)
+        with open(f.name, 'w') as f:
+            f.write("function = off\n")
+        with mock.patch.object(switches, "load", wraps=switches.load) as load:
+            os.kill(os.getpid(), signal.SIGUSR2)
+            # the handler itself does not reload
+            load.assert_not_called()
+            deadline = time.monotonic() + 5
+            while not profiler._DISABLED and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertTrue(profiler._DISABLED)
+
+    def test_watch(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.switches', delete=False) as f:
+            f.write("http = on\n")
+        self.addCleanup(os.unlink, f.name)
+
+        stop = switches.watch(f.name, interval=0.01)
+        self.addCleanup(stop.set)
+        with open(f.name, 'w') as f:
+            f.write("http = off\n")
+        os.utime(f.name, ns=(time.time_ns() + 10 ** 9,) * 2)
+        deadline = time.monotonic() + 5
+        while switches.is_enabled('http') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(switches.is_enabled('http'))
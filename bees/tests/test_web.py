@@ -1,14 +1,20 @@
 from __future__ import absolute_import
 
+import asyncio
 from unittest import TestCase, mock
 
+from opentracing.propagation import Format
+
 from bees import web
 
 
 class TestWeb(TestCase):
 
-    def tearDown(self) -> None:
-        web._DISABLED = None
+    def setUp(self):
+        # None leaves the decision to each middleware's ``enabled`` setting
+        patcher = mock.patch.object(web, "_DISABLED", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_disabled(self):
         web.enable()
@@ -48,3 +54,65 @@ class TestWeb(TestCase):
         self.assertEqual(middleware(request), "Catch!")
         mock_tracer.extract.assert_called_once()
         mock_tracer.start_active_span.assert_called_once()
+
+
+class TestAsgiMiddleware(TestCase):
+
+    def setUp(self):
+        # None leaves the decision to each middleware's ``enabled`` setting
+        patcher = mock.patch.object(web, "_DISABLED", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _call(middleware, scope):
+        sent = []
+
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'Catch!'})
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            sent.append(message)
+
+        middleware.application = app
+        asyncio.run(middleware(scope, receive, send))
+        return sent
+
+    @mock.patch("opentracing.tracer")
+    def test_middleware_disable(self, mock_tracer):
+        middleware = web.AsgiMiddleware(None)
+        sent = self._call(middleware, {'type': 'http', 'headers': []})
+        self.assertEqual(sent[1]['body'], b'Catch!')
+        mock_tracer.start_active_span.assert_not_called()
+
+    @mock.patch("opentracing.tracer")
+    def test_middleware_lifespan(self, mock_tracer):
+        middleware = web.AsgiMiddleware(None, enabled=True)
+        self._call(middleware, {'type': 'lifespan'})
+        mock_tracer.start_active_span.assert_not_called()
+
+    @mock.patch("bees.eventlet.codecs.extract")
+    @mock.patch("opentracing.tracer")
+    def test_middleware_enable(self, mock_tracer, mock_extract):
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/v2.0/ports',
+            'query_string': b'limit=1',
+            'headers': [(b'x-trace-info', b'{}'), (b'host', b'neutron')],
+        }
+        middleware = web.AsgiMiddleware(None, enabled=True)
+        sent = self._call(middleware, scope)
+
+        self.assertEqual(len(sent), 2)
+        mock_extract.assert_called_once_with(
+            mock_tracer, Format.HTTP_HEADERS, {'X-Trace-Info': '{}', 'host': 'neutron'})
+        mock_tracer.start_active_span.assert_called_once()
+
+        mock_span = mock_tracer.start_active_span.return_value.__enter__.return_value.span
+        self.assertIn(mock.call('http.status_code', 200), mock_span.set_tag.call_args_list)
+        self.assertIn(mock.call('http.target', 'limit=1'), mock_span.set_tag.call_args_list)
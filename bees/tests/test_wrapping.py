@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+
+from unittest import TestCase
+
+from bees.patch import wrapping
+
+
+class _Client(object):
+
+    def request(self, url, method, json=None, endpoint_filter=None, *, timeout=None, **kwargs):
+        return url, method, endpoint_filter, timeout, kwargs
+
+
+class TestWrapping(TestCase):
+
+    def setUp(self):
+        self.arguments = wrapping.Arguments('endpoint_filter', 'timeout', var_keyword=True)
+        self.seen = []
+
+        def request_wrapper(client, url, method, *args, **kwargs):
+            self.seen.append((self.arguments.get(args, kwargs, 'endpoint_filter'),
+                              self.arguments.get(args, kwargs, 'timeout', 30)))
+            wrapping.headers(kwargs)['X-Trace'] = '1'
+            return wrapping.original(_Client, 'request')(client, url, method, *args, **kwargs)
+
+        self.wrapper = request_wrapper
+        self.addCleanup(wrapping.unpatch_all)
+
+    def test_patch_and_unpatch(self):
+        original = _Client.request
+        wrapping.patch(_Client, 'request', self.wrapper, self.arguments)
+        self.assertTrue(wrapping.is_patched(_Client, 'request'))
+
+        caller_headers = {'Accept': 'json'}
+        result = _Client().request('/servers', 'GET', None, {'service_type': 'compute'}, headers=caller_headers)
+        self.assertEqual(result[2], {'service_type': 'compute'})
+        self.assertEqual(result[4]['headers'], {'Accept': 'json', 'X-Trace': '1'})
+        self.assertEqual(caller_headers, {'Accept': 'json'})
+
+        _Client().request('/servers', 'GET', endpoint_filter={'service_type': 'network'}, timeout=5)
+        self.assertEqual(self.seen, [({'service_type': 'compute'}, 30), ({'service_type': 'network'}, 5)])
+
+        wrapping.patch(_Client, 'request', self.wrapper, self.arguments)
+        wrapping.unpatch(_Client, 'request')
+        self.assertIs(_Client.request, original)
+        self.assertFalse(wrapping.is_patched(_Client, 'request'))
+        wrapping.unpatch(_Client, 'request')
+
+    def test_signature_mismatch(self):
+        original = _Client.request
+        for arguments in (wrapping.Arguments('service_type'), wrapping.Arguments('kwargs')):
+            self.assertRaises(wrapping.SignatureMismatch, wrapping.patch, _Client, 'request', self.wrapper, arguments)
+
+        def reordered_wrapper(client, method, url, *args, **kwargs):
+            pass
+
+        self.assertRaises(wrapping.SignatureMismatch, wrapping.patch, _Client, 'request', reordered_wrapper)
+        self.assertRaises(wrapping.SignatureMismatch, wrapping.verify, lambda self, url, method: None, self.wrapper,
+                          'request', arguments=wrapping.Arguments('url', var_keyword=True))
+        self.assertIs(_Client.request, original)
+
+    def test_module_function(self):
+        arguments = wrapping.Arguments('raw_msg')
+        arguments.verify(lambda raw_msg: raw_msg, 'serialize_msg', method=False)
+        self.assertEqual(arguments.get(('msg',), {}, 'raw_msg'), 'msg')
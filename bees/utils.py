@@ -213,6 +213,68 @@ def get_own_members(object, predicate=None):
     return results
 
 
+def get_class_functions(obj):
+    """Return the functions of a class as (name, function, wrapper) triples.
+
+    Walks the ``__dict__`` of every class in the MRO once, without calling
+    ``dir()`` or ``getattr()``, so descriptors and properties are never
+    invoked. A name defined on a subclass hides the same name on its
+    bases, whatever its type. ``wrapper`` is ``staticmethod`` or
+    ``classmethod`` for those, with ``function`` the plain function they
+    wrap, and None for regular methods. :class:`LazyTraced` attributes
+    are installed first and reported as the functions they install.
+    """
+    cls = obj if inspect.isclass(obj) else obj.__class__
+    results = []
+    seen = set()
+    for klass in cls.__mro__:
+        for name, value in vars(klass).items():
+            if name in seen:
+                continue
+            seen.add(name)
+            if isinstance(value, LazyTraced):
+                value = value.install()
+            if isinstance(value, types.FunctionType):
+                results.append((name, value, None))
+            elif isinstance(value, (staticmethod, classmethod)):
+                if isinstance(value.__func__, types.FunctionType):
+                    results.append((name, value.__func__, type(value)))
+    return results
+
+
+class LazyTraced(object):
+    """Class attribute that traces a method on first access.
+
+    Set on a class in place of ``function``; the first lookup, through the
+    class or one of its instances, calls ``decorate(function)``, wraps the
+    result in ``wrapper`` (``staticmethod``, ``classmethod`` or None) and
+    sets it on ``owner``, so later lookups find the traced method directly.
+    Methods that are never used are never traced.
+    """
+
+    __slots__ = ('owner', 'name', 'function', 'wrapper', 'decorate')
+
+    def __init__(self, owner, name, function, wrapper, decorate):
+        self.owner = owner
+        self.name = name
+        self.function = function
+        self.wrapper = wrapper
+        self.decorate = decorate
+
+    def install(self):
+        """Trace the method and set it on the owner class in place of self."""
+
+        traced = self.decorate(self.function)
+        if self.wrapper is not None:
+            traced = self.wrapper(traced)
+        # greenthreads racing here install equivalent wrappers, last one wins
+        setattr(self.owner, self.name, traced)
+        return traced
+
+    def __get__(self, instance, owner=None):
+        return self.install().__get__(instance, owner)
+
+
 def get_members(obj, exclude_hidden=True):
     """
     Yields the members of an object, filtering by hidden/not hidden.
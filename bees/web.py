@@ -7,6 +7,9 @@ from opentracing.propagation import Format
 
 import eventlet
 
+from . import switches
+from .eventlet import codecs
+
 _DISABLED = False
 
 
@@ -24,6 +27,9 @@ def enable():
     _DISABLED = False
 
 
+switches.register('web', enable, disable)
+
+
 class WsgiMiddleware(object):
     """WSGI Middleware that enables tracing for an application."""
 
@@ -105,3 +111,60 @@ class EventletWsgiMiddleware(object):
 
         eventlet.sleep()
         return response
+
+
+def _asgi_headers(scope):
+    """Decode ASGI headers into a carrier understood by eventlet.codecs."""
+
+    headers = {}
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        headers[_CODEC_HEADERS.get(name.lower(), name)] = value.decode('latin-1')
+    return headers
+
+
+_CODEC_HEADERS = {
+    codecs.X_TRACE_INFO.lower(): codecs.X_TRACE_INFO,
+    codecs.X_TRACE_HMAC.lower(): codecs.X_TRACE_HMAC,
+}
+
+
+class AsgiMiddleware(object):
+    """ASGI Middleware that enables tracing for an application.
+
+    Use it together with ``bees.asyncio.scope_manager.ContextVarsScopeManager``
+    so the request span stays active across ``await`` boundaries.
+    """
+
+    def __init__(self, application, enabled=False, **kwargs):
+        """Initialize middleware with the wrapped ASGI application."""
+
+        self.application = application
+        self.name = "asgi"
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http'
+                or _DISABLED is not None and _DISABLED
+                or _DISABLED is None and not self.enabled):
+            return await self.application(scope, receive, send)
+
+        tracer = global_tracer()
+        headers = _asgi_headers(scope)
+        span_ctx = codecs.extract(tracer, Format.HTTP_HEADERS, headers)
+        span_tags = {tags.SPAN_KIND: tags.SPAN_KIND_RPC_SERVER}
+
+        with tracer.start_active_span(operation_name=self.name, child_of=span_ctx, tags=span_tags) as active:
+            span = active.span
+            span.set_tag('http.method', scope.get('method'))
+            span.set_tag('http.scheme', scope.get('scheme', 'http'))
+            span.set_tag('http.url', scope.get('path'))
+            span.set_tag('http.target', scope.get('query_string', b'').decode('latin-1'))
+            span.set_tag('http.headers', headers)
+
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start':
+                    span.set_tag('http.status_code', message['status'])
+                await send(message)
+
+            await self.application(scope, receive, send_wrapper)
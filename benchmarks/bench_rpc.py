@@ -0,0 +1,87 @@
+"""Client-side overhead of the oslo.messaging RPC patch per message.
+
+Runs ``call_wrapper``/``cast_wrapper`` against a stubbed transport and
+reports the per-message cost and the CPU share it takes at 5k msg/s,
+with and without fan-out cast coalescing.
+
+Usage: python -m benchmarks.bench_rpc [messages]
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import sys
+import time
+
+import opentracing
+from jaeger_client import Tracer
+from jaeger_client.reporter import NullReporter
+from jaeger_client.sampler import ConstSampler
+
+from bees.patch import oslo_rpc
+
+RATE = 5000
+
+
+class _Context(object):
+    request_id = 'req-bench'
+
+
+class _Target(object):
+    topic = 'q-agent-notifier-port-update'
+    server = None
+    version = '1.0'
+    namespace = None
+    fanout = False
+
+
+class _CallContext(object):
+    target = _Target()
+
+
+def _stub(self, ctxt, method, **kwargs):
+    return None
+
+
+def _kwargs():
+    return {'port': {'id': 'a' * 36, 'fixed_ips': [{'subnet_id': 'b' * 36, 'ip_address': '10.0.0.%d' % i}
+                                                   for i in range(8)]},
+            'network_type': 'vxlan', 'segmentation_id': 1001}
+
+
+def bench(wrapper, n):
+    call_context = _CallContext()
+    kwargs = _kwargs()
+    start = time.perf_counter()
+    for _ in range(n):
+        wrapper(call_context, _Context(), 'port_update', **kwargs)
+    return time.perf_counter() - start
+
+
+def main(n=RATE * 4):
+    oslo_rpc._BaseCallContext_call = _stub
+    oslo_rpc._BaseCallContext_cast = _stub
+    logging.basicConfig(level=logging.INFO)
+
+    for sampled in (True, False):
+        opentracing.tracer = Tracer(service_name='bench', reporter=NullReporter(),
+                                    sampler=ConstSampler(sampled))
+        plain = bench(_stub, n)
+        for name, wrapper in (('call', oslo_rpc.call_wrapper), ('cast', oslo_rpc.cast_wrapper)):
+            traced = bench(wrapper, n)
+            per_message = (traced - plain) / n
+            print('%s (sampled=%s): %.2f us/msg, %.1f%% of one core at %d msg/s'
+                  % (name, sampled, per_message * 1e6, per_message * RATE * 100, RATE))
+
+        # fan-out storm: every cast made under one parent span
+        oslo_rpc.set_cast_coalescing(1.0)
+        with opentracing.tracer.start_active_span('update_ports'):
+            traced = bench(oslo_rpc.cast_wrapper, n)
+        oslo_rpc.set_cast_coalescing(None)
+        per_message = (traced - plain) / n
+        print('coalesced cast (sampled=%s): %.2f us/msg, %.1f%% of one core at %d msg/s'
+              % (sampled, per_message * 1e6, per_message * RATE * 100, RATE))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
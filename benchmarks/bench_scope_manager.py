@@ -0,0 +1,96 @@
+"""Activate/close throughput of the scope managers.
+
+Compares EventletScopeManager with the previous attribute-per-access
+implementation, opentracing's ThreadLocalScopeManager and the
+ContextVarsScopeManager, for flat and nested (depth 3) activations.
+
+Usage: python -m benchmarks.bench_scope_manager [iterations]
+"""
+
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+
+import eventlet
+from opentracing import Scope, ScopeManager
+from opentracing.scope_managers import ThreadLocalScopeManager
+from opentracing.scope_managers.constants import ACTIVE_ATTR
+
+from bees.asyncio.scope_manager import ContextVarsScopeManager
+from bees.eventlet.scope_manager import EventletScopeManager
+
+
+class _PreviousEventletScopeManager(ScopeManager):
+    """EventletScopeManager as it was before per-greenthread slots."""
+
+    def activate(self, span, finish_on_close):
+        scope = _PreviousEventletScope(self, span, finish_on_close)
+        self._set_scope(scope)
+        return scope
+
+    @property
+    def active(self):
+        return self._get_scope()
+
+    def _get_scope(self, greenthread=None):
+        if greenthread is None:
+            greenthread = eventlet.getcurrent()
+
+        return getattr(greenthread, ACTIVE_ATTR, None)
+
+    def _set_scope(self, scope, greenthread=None):
+        if greenthread is None:
+            greenthread = eventlet.getcurrent()
+
+        setattr(greenthread, ACTIVE_ATTR, scope)
+
+
+class _PreviousEventletScope(Scope):
+    def __init__(self, manager, span, finish_on_close):
+        super(_PreviousEventletScope, self).__init__(manager, span)
+        self._finish_on_close = finish_on_close
+        self._to_restore = manager.active
+
+    def close(self):
+        if self.manager.active is not self:
+            return
+
+        self.manager._set_scope(self._to_restore)
+
+        if self._finish_on_close:
+            self.span.finish()
+
+
+class _Span(object):
+    def finish(self):
+        pass
+
+
+def bench(manager, n, depth):
+    span = _Span()
+    start = time.perf_counter()
+    for _ in range(n):
+        scopes = [manager.activate(span, False) for _ in range(depth)]
+        manager.active
+        for scope in reversed(scopes):
+            scope.close()
+    return n * depth / (time.perf_counter() - start)
+
+
+def main(n=200000):
+    managers = (
+        ('EventletScopeManager', EventletScopeManager()),
+        ('previous EventletScopeManager', _PreviousEventletScopeManager()),
+        ('ThreadLocalScopeManager', ThreadLocalScopeManager()),
+        ('ContextVarsScopeManager', ContextVarsScopeManager()),
+    )
+    for depth in (1, 3):
+        for name, manager in managers:
+            # run inside a greenthread, as the eventlet managers do in production
+            rate = eventlet.spawn(bench, manager, n, depth).wait()
+            print('%-30s depth %d: %10.0f activate/close per second' % (name, depth, rate))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
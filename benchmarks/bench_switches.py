@@ -0,0 +1,124 @@
+"""Cost of disabled instrumentation.
+
+A disabled bees wrapper adds one Python call and one branch in front of
+the wrapped callable, a fixed cost whatever that callable does. The cost
+is measured precisely for each wrapper around a trivial callable, where
+it is several times the call itself; it must stay below MAX_FIXED_COST.
+Against callables doing real work (a neutron-style handler building a
+port, oslo.messaging's serialize_msg) it must stay within MAX_OVERHEAD of
+the undecorated call. Direct timings of those calls are printed as well,
+but differ by several percent between runs on a busy machine, so the
+check uses the fixed cost.
+
+Rounds of the plain and wrapped calls are interleaved and the best of
+each is kept. Exits with an error if a check fails.
+
+Usage: python -m benchmarks.bench_switches [iterations]
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import sys
+import time
+from unittest import mock
+
+from opentracing.mocktracer import MockTracer
+
+from bees import decorate, profiler, switches
+from bees.patch import oslo_rpc
+
+#: Largest accepted slowdown of a disabled wrapper around real work.
+MAX_OVERHEAD = 0.05
+
+#: Largest accepted cost in seconds a disabled wrapper adds to any call.
+MAX_FIXED_COST = 1e-6
+
+ROUNDS = 7
+
+
+def add(a, b):
+    return a + b
+
+
+def make_port(network_id, index):
+    return json.dumps({
+        'id': 'port-%d' % index,
+        'network_id': network_id,
+        'fixed_ips': [{'subnet_id': 'subnet-1', 'ip_address': '10.0.0.%d' % (index % 250)}],
+        'binding:host_id': 'compute-1',
+        'device_owner': 'compute:nova',
+        'security_groups': ['sg-default'],
+    }, sort_keys=True)
+
+
+MESSAGE = {
+    'method': 'update_device_list',
+    'args': {'devices_up': ['tap%08d' % i for i in range(20)], 'devices_down': [], 'agent_id': 'ovs-agent-1'},
+    'version': '1.5',
+}
+
+
+def bench(func, args, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func(*args)
+    return (time.perf_counter() - start) / n
+
+
+def compare(plain, wrapped, args, n):
+    """Return the best per-call time of ``plain`` and ``wrapped``."""
+
+    plain_times, wrapped_times = [], []
+    for _ in range(ROUNDS):
+        plain_times.append(bench(plain, args, n))
+        wrapped_times.append(bench(wrapped, args, n))
+    return min(plain_times), min(wrapped_times)
+
+
+def identity(msg):
+    return msg
+
+
+def main(n=200000):
+    failures = []
+    with mock.patch('opentracing.tracer', MockTracer()):
+        # the fixed cost of each disabled wrapper, around a trivial callable
+        switches.disable()
+        fixed_costs = {}
+        with mock.patch.object(oslo_rpc, '_serialize_msg', identity):
+            for name, plain, wrapped, args in (
+                    ('profiler.trace', add, profiler.trace('add')(add), (1, 2)),
+                    ('decorate.trace', add, decorate.trace('add')(add), (1, 2)),
+                    ('serialize_msg_wrapper', identity, oslo_rpc.serialize_msg_wrapper, (MESSAGE,))):
+                baseline, disabled = compare(plain, wrapped, args, n)
+                fixed_costs[name] = disabled - baseline
+                print('%-22s trivial call %6.0f ns, disabled wrapper adds %4.0f ns' % (
+                    name, baseline * 1e9, fixed_costs[name] * 1e9))
+                if fixed_costs[name] > MAX_FIXED_COST:
+                    failures.append('%s: disabled wrapper adds %.0f ns' % (name, fixed_costs[name] * 1e9))
+
+        # the same wrappers around real work
+        for name, plain, wrapped, args, subsystem in (
+                ('profiler.trace', make_port, profiler.trace('port')(make_port), ('net-1', 7), 'function'),
+                ('decorate.trace', make_port, decorate.trace('port')(make_port), ('net-1', 7), 'function'),
+                ('serialize_msg_wrapper', oslo_rpc._serialize_msg, oslo_rpc.serialize_msg_wrapper, (MESSAGE,),
+                 'rpc')):
+            switches.disable(subsystem)
+            baseline, disabled = compare(plain, wrapped, args, n // 20)
+            switches.enable(subsystem)
+            enabled = bench(wrapped, args, n // 200)
+            overhead = fixed_costs[name] / baseline
+            print('%-22s undecorated %6.0f ns, disabled %+5.1f%% (measured %+5.1f%%), enabled %6.0f ns' % (
+                name, baseline * 1e9, overhead * 100, (disabled / baseline - 1) * 100, enabled * 1e9))
+            if overhead > MAX_OVERHEAD:
+                failures.append('%s: disabled overhead %.1f%% over %.0f%%' % (
+                    name, overhead * 100, MAX_OVERHEAD * 100))
+    switches.enable()
+
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,73 @@
+"""Class scan time of trace_cls.
+
+Compares the previous member scan (``dir()`` and ``getattr()`` on every
+name, then an MRO lookup per method) with ``get_class_functions``, and
+times the whole ``trace_cls`` decoration, eager and lazy, for a class
+hierarchy with many methods.
+
+Usage: python -m benchmarks.bench_trace_cls [methods] [depth] [repeat]
+"""
+
+from __future__ import absolute_import, print_function
+
+import inspect
+import sys
+import time
+
+from bees import profiler
+from bees.utils import get_class_functions, get_own_members
+
+
+def previous_scan(cls):
+    """The member scan of trace_cls before get_class_functions."""
+
+    clss = cls if inspect.isclass(cls) else cls.__class__
+    mro_dicts = [c.__dict__ for c in inspect.getmro(clss)]
+    results = []
+    for attr_name, attr in get_own_members(cls):
+        if not (inspect.ismethod(attr) or inspect.isfunction(attr)):
+            continue
+        for cls_dict in mro_dicts:
+            if attr_name in cls_dict:
+                results.append((attr_name, attr, cls_dict[attr_name]))
+                break
+    return results
+
+
+def _method(self, *args):
+    return args
+
+
+def build_hierarchy(methods, depth):
+    """Return the leaf of a ``depth`` deep hierarchy, each level defining
+    ``methods`` methods and a few properties."""
+
+    bases = (object,)
+    for level in range(depth):
+        namespace = dict(('method_%d_%d' % (level, i), _method) for i in range(methods))
+        namespace.update(('prop_%d_%d' % (level, i), property(_method)) for i in range(methods // 10))
+        cls = type('Level%d' % level, bases, namespace)
+        bases = (cls,)
+    return cls
+
+
+def bench(func, cls, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(cls)
+    return (time.perf_counter() - start) / repeat
+
+
+def main(methods=1000, depth=5, repeat=20):
+    cls = build_hierarchy(methods, depth)
+    print('%d methods over %d classes' % (methods * depth, depth))
+    print('%-25s %8.2f ms' % ('previous scan', bench(previous_scan, cls, repeat) * 1000))
+    print('%-25s %8.2f ms' % ('get_class_functions', bench(get_class_functions, cls, repeat) * 1000))
+    decorate = lambda leaf: profiler.trace_cls('bench')(type('Traced', (leaf,), {}))
+    print('%-25s %8.2f ms' % ('trace_cls', bench(decorate, cls, repeat) * 1000))
+    decorate_lazy = lambda leaf: profiler.trace_cls('bench', lazy=True)(type('Traced', (leaf,), {}))
+    print('%-25s %8.2f ms' % ('trace_cls lazy', bench(decorate_lazy, cls, repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+"""Per-request overhead of the WSGI and ASGI tracing middlewares.
+
+Usage: python -m benchmarks.bench_web [requests]
+"""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+import sys
+import time
+
+import opentracing
+import webob
+from jaeger_client import Tracer
+from jaeger_client.reporter import NullReporter
+from jaeger_client.sampler import ConstSampler
+from opentracing.scope_managers import ThreadLocalScopeManager
+
+from bees import web
+from bees.asyncio.scope_manager import ContextVarsScopeManager
+
+
+def _wsgi_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+async def _asgi_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+def _install_tracer(scope_manager):
+    opentracing.tracer = Tracer(service_name='bench', reporter=NullReporter(),
+                                sampler=ConstSampler(True), scope_manager=scope_manager)
+
+
+def bench_wsgi(n, enabled):
+    _install_tracer(ThreadLocalScopeManager())
+    app = web.WsgiMiddleware(_wsgi_app, enabled=enabled) if enabled else _wsgi_app
+    request = webob.Request.blank('/v2.0/ports?limit=1')
+
+    start = time.perf_counter()
+    for _ in range(n):
+        request.get_response(app)
+    return time.perf_counter() - start
+
+
+def bench_asgi(n, enabled):
+    _install_tracer(ContextVarsScopeManager())
+    app = web.AsgiMiddleware(_asgi_app, enabled=enabled) if enabled else _asgi_app
+    scope = {'type': 'http', 'method': 'GET', 'scheme': 'http', 'path': '/v2.0/ports',
+             'query_string': b'limit=1', 'headers': [(b'host', b'neutron')]}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        pass
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(n):
+            await app(scope, receive, send)
+        return time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def main(n=20000):
+    web._DISABLED = None
+    for name, bench in (('wsgi', bench_wsgi), ('asgi', bench_asgi)):
+        plain = bench(n, enabled=False)
+        traced = bench(n, enabled=True)
+        print('%s: plain %.2f us/req, traced %.2f us/req, overhead %.2f us/req'
+              % (name, plain / n * 1e6, traced / n * 1e6, (traced - plain) / n * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])